@@ -1,236 +1,55 @@
-import streamlit as st
-import requests
-import pandas as pd
 from datetime import datetime
-import time
-from urllib.parse import urlparse
-import io
-from openpyxl import Workbook
-from openpyxl.styles import Alignment, PatternFill, Font
-from openpyxl.utils import get_column_letter
-import google.generativeai as genai
-from PIL import Image
-
-# ▼▼▼ 設定エリア (楽天) ▼▼▼
-APP_ID = '1052224946268447244' 
-REVIEW_RATE = 0.08  
-PRICE_UPLIFT = 1.2  
-
-# --- ページ設定 ---
-st.set_page_config(page_title="EC運営支援ツール Suite Pro", page_icon="🛍️", layout="wide")
-
-# --- CSSスタイル ---
-st.markdown("""
-<style>
-    .main { padding-top: 2rem; }
-    .stButton>button { width: 100%; border-radius: 5px; height: 3em; background-color: #BF0000; color: white; font-weight: bold; }
-    .stDownloadButton>button { width: 100%; border-radius: 5px; height: 3em; background-color: #008000; color: white; }
-    textarea { font-family: monospace; }
-</style>
-""", unsafe_allow_html=True)
-
-# ==========================================
-# 共通・ロジック関数群 (楽天)
-# ==========================================
-
-def get_item_key_from_url(url):
-    try:
-        parsed = urlparse(url)
-        path_parts = [p for p in parsed.path.split('/') if p]
-        if len(path_parts) >= 2: return path_parts[-1]
-        return url
-    except: return url
-
-def calculate_metrics(item, uplift, rate):
-    price = item['itemPrice']
-    review_count = item['reviewCount']
-    item_name = item['itemName']
-    catch_copy = item.get('catchcopy', '')
-    
-    adj_price = int(price * uplift)
-    total_sales_vol = int(review_count / rate)
-    total_sales_amt = total_sales_vol * adj_price
-    
-    full_text = (item_name + catch_copy).replace(" ", "")
-    coupon_flg = "-"
-    if any(x in full_text for x in ["クーポン", "OFF", "値引", "SALE"]):
-        coupon_flg = "有"
-    
-    return {
-        "商品名": item_name, "価格": price, "ポイント倍率": item['pointRate'],
-        "クーポン有無": coupon_flg, "レビュー総数": review_count,
-        "推定累積販売数": total_sales_vol, "推定累積売上": total_sales_amt,
-        "ショップ名": item['shopName'], "ショップコード": item['shopCode'],
-        "商品URL": item['itemUrl'], "ジャンルID": item['genreId']
-    }
-
-def search_items(query, limit=10):
-    url = "https://app.rakuten.co.jp/services/api/IchibaItem/Search/20170706"
-    if "http" in query:
-        keyword = get_item_key_from_url(query)
-        search_type = "URL検索"
-    elif query.isdigit() and len(query) > 7:
-        keyword = query
-        search_type = "JAN検索"
-    else:
-        keyword = query
-        search_type = "ワード検索"
-
-    params = {"applicationId": APP_ID, "keyword": keyword, "hits": limit, "sort": "-reviewCount", "availability": 1}
-    try:
-        time.sleep(0.5)
-        res = requests.get(url, params=params, timeout=10)
-        data = res.json()
-        results = []
-        if 'Items' in data:
-            for w in data['Items']:
-                metrics = calculate_metrics(w['Item'], PRICE_UPLIFT, REVIEW_RATE)
-                metrics['検索条件'] = query
-                metrics['検索タイプ'] = search_type
-                results.append(metrics)
-        return results
-    except: return []
-
-def get_shop_top_items(shop_code, shop_name, limit=30):
-    url = "https://app.rakuten.co.jp/services/api/IchibaItem/Search/20170706"
-    params = {"applicationId": APP_ID, "shopCode": shop_code, "hits": limit, "sort": "-reviewCount", "availability": 1}
-    try:
-        time.sleep(0.5)
-        res = requests.get(url, params=params, timeout=10)
-        data = res.json()
-        results = []
-        if 'Items' in data:
-            for w in data['Items']:
-                metrics = calculate_metrics(w['Item'], PRICE_UPLIFT, REVIEW_RATE)
-                metrics['対象店舗'] = shop_name
-                results.append(metrics)
-        return results
-    except: return []
-
-def get_current_price_for_rpp(item_manage_number, shop_code):
-    url = "https://app.rakuten.co.jp/services/api/IchibaItem/Search/20170706"
-    keyword = str(item_manage_number).strip()
-    if ":" in keyword:
-        keyword = keyword.split(":")[-1]
-
-    params = {
-        "applicationId": APP_ID, "shopCode": shop_code,
-        "keyword": keyword, "hits": 1
-    }
-    
-    try:
-        res = requests.get(url, params=params, timeout=5)
-        data = res.json()
-        
-        if res.status_code == 200:
-            if 'Items' in data and len(data['Items']) > 0:
-                return data['Items'][0]['Item']['itemPrice'], "成功"
-            else:
-                return None, "該当なし"
-        else:
-            return None, f"APIエラー({res.status_code})"
-    except Exception as e:
-        return None, "通信エラー"
-
-def clean_number(val, default_val=0):
-    if pd.isna(val): return default_val
-    s_val = str(val).replace(',', '').replace('円', '').replace('%', '').strip()
-    if s_val == '' or s_val.lower() == 'nan': return default_val
-    try:
-        return float(s_val)
-    except:
-        return default_val
-
-def format_worksheet(worksheet):
-    left_align = Alignment(horizontal='left', vertical='center')
-    fill_color = PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid")
-    hyperlink_font = Font(color="0000FF", underline="single")
-    
-    num_cols = ["価格", "レビュー総数", "推定累積販売数", "推定累積売上", 
-                "現在価格", "入札単価", "推奨入札単価", "商品CPC", "クリック数(合計)", 
-                "実績額(合計)", "CPC実績(合計)", "売上金額(合計720時間)", "売上件数(合計720時間)", "注文獲得単価(合計720時間)"]
-    
-    for row in worksheet.iter_rows():
-        worksheet.row_dimensions[row[0].row].height = 25
-        for cell in row:
-            cell.alignment = left_align
-            if cell.row == 1:
-                cell.fill = fill_color
-                continue
-            
-            header_val = worksheet.cell(row=1, column=cell.column).value
-            if header_val in num_cols:
-                cell.number_format = '#,##0'
-            if header_val == "商品URL" and cell.value:
-                cell.hyperlink = cell.value
-                cell.font = hyperlink_font
-
-    worksheet.freeze_panes = 'A2'
-    worksheet.auto_filter.ref = worksheet.dimensions
-    for col in worksheet.columns:
-        column = get_column_letter(col[0].column)
-        worksheet.column_dimensions[column].width = 18
-
-# ==========================================
-# 共通・ロジック関数群 (ブログAI生成: GitHub対応版)
-# ==========================================
-def generate_blog_content(api_key, image, keywords, tone):
-    genai.configure(api_key=api_key)
-    
-    prompt = f"""
-    あなたはプロのECサイト運営者兼ブロガーです。
-    アップロードされた商品画像を見て、以下の条件でブログ記事を作成してください。
-
-    【ターゲット・キーワード】
-    {keywords}
-
-    【文体のトーン】
-    {tone}
-
-    【出力要件】
-    1. 記事のタイトルを作成してください。
-    2. 記事の本文は、そのままWordPressやShopifyに貼り付けられる「HTML形式」で出力してください。
-    3. <h2>, <h3>, <p>, <ul>, <li> などのタグを適切に使用し、読みやすくしてください。
-    4. 画像の視覚的特徴（色、素材、雰囲気）を具体的に描写し、読者が商品をイメージできるようにしてください。
-    5. SEOを意識し、キーワードを自然に盛り込んでください。
-    6. 記事の最後には、購買意欲をそそるまとめを書いてください。
-    
-    【画像生成用プロンプト】
-    記事の最後に、別途「この商品を魅力的なシーンで撮影したような画像をAIで作るための英語の指示文（Prompt）」を作成してください。
-    （例: A photorealistic shot of a ceramic vase on a wooden table, sunlight streaming through a window, cozy scandinavian style, 8k resolution...）
-    """
-
-    # 修正点: 廃止された 'gemini-pro-vision' を削除し、最新の1.5系のみを使用
-    if image:
-        # 画像がある場合: マルチモーダル対応の1.5系のみ
-        models_to_try = ['gemini-1.5-pro', 'gemini-1.5-flash']
-    else:
-        # 画像がない場合: 旧gemini-proも可だが、基本は1.5系推奨
-        models_to_try = ['gemini-1.5-pro', 'gemini-1.5-flash', 'gemini-pro']
-
-    last_error = None
-    
-    for model_name in models_to_try:
-        try:
-            model = genai.GenerativeModel(model_name)
-            if image:
-                response = model.generate_content([prompt, image])
-            else:
-                response = model.generate_content(prompt)
-            return response.text 
-            
-        except Exception as e:
-            last_error = e
-            # エラー内容をコンソールに出力してデバッグしやすくする
-            print(f"Model {model_name} failed: {e}")
-            continue
-
-    return f"エラー: AIモデルでの生成に失敗しました。\n詳細: {last_error}\n対策: requirements.txtに 'google-generativeai>=0.8.3' が含まれているか確認してください。"
+import pandas as pd
+from rakuten_core import (
+    EXPORT_FORMATS, SEARCH_DEPTHS, CheckpointStore, JobBusyError, get_checkpoint_store, get_job_runner,
+    get_snapshot_store, build_trend_tables, competitor_job, rpp_job, load_rpp_report,
+    rpp_multi_job, guess_shop_code, RPP_SHOP_WORKERS,
+    export_tables, generate_blog_content, BLOG_TONES, BLOG_WORKERS, BLOG_QPS,
+    GeminiBackend, StubBackend, load_blog_batch, blog_batch_job,
+    BLOG_IMAGE_MAX_EDGE, preprocess_image, METRICS,
+)
 
 # ==========================================
 # メインアプリケーション
 # ==========================================
 def main():
+    # Streamlitはロジック部分(rakuten_core)のインポートやCLI実行時には読み込まない
+    import streamlit as st
+
+    # --- ページ設定 ---
+    st.set_page_config(page_title="EC運営支援ツール Suite Pro", page_icon="🛍️", layout="wide")
+
+    # --- CSSスタイル ---
+    st.markdown("""
+    <style>
+        .main { padding-top: 2rem; }
+        .stButton>button { width: 100%; border-radius: 5px; height: 3em; background-color: #BF0000; color: white; font-weight: bold; }
+        .stDownloadButton>button { width: 100%; border-radius: 5px; height: 3em; background-color: #008000; color: white; }
+        textarea { font-family: monospace; }
+    </style>
+    """, unsafe_allow_html=True)
+
+    def job_panel(state_key, render_result, error_label):
+        """セッションに紐づくバックグラウンドジョブの進捗・結果を表示する (実行中は1秒ごとに部分更新)"""
+        job = get_job_runner().get(st.session_state.get(state_key))
+        if job is None: return
+        finished_at_start = job.finished
+
+        @st.fragment(run_every=None if finished_at_start else 1.0)
+        def panel():
+            if not job.finished:
+                st.progress(job.progress, text=job.message)
+                st.caption("処理中も他の操作ができます。")
+            elif not finished_at_start:
+                # 完了したら画面全体を再描画して定期更新を止める
+                st.rerun()
+            elif job.status == "error":
+                st.error(f"{error_label}: {job.error}")
+            else:
+                st.progress(1.0)
+                render_result(job.result)
+        panel()
+
     st.title("EC運営支援ツール Suite Pro")
     
     tab1, tab2, tab3 = st.tabs(["📊 楽天:競合分析", "💰 楽天:RPP改善", "📝 ブログ自動生成"])
@@ -242,71 +61,82 @@ def main():
         st.subheader("競合・市場調査")
         st.markdown("調査したい **キーワード、JAN、URL** を入力してください。")
         input_text = st.text_area("検索リスト", height=150, placeholder="例:\n北欧 花瓶\n4968912801046", key="comp_input")
+        search_limit = st.select_slider("1キーワードあたりの取得件数", options=SEARCH_DEPTHS, value=SEARCH_DEPTHS[0], key="comp_limit",
+                                        help="30件を超えると複数ページを並列取得します (推定累積売上の市場規模把握向け)")
+        force_refresh = st.checkbox("キャッシュを使わず最新データを取得する", value=False, key="comp_refresh")
+        comp_format = st.radio("出力形式", list(EXPORT_FORMATS), horizontal=True, key="comp_format")
+        max_shops = st.number_input("1回の店舗取得上限 (0=無制限)", min_value=0, value=0, step=10, key="comp_max_shops",
+                                    help="検索ヒット数の多い店舗から順に取得します。最近取得した店舗は再取得しません。")
+        
+        target_list = [{'query': line.strip()} for line in input_text.split('\n') if line.strip()]
+        queries = [target['query'] for target in target_list]
+        store = get_checkpoint_store()
+        checkpoint_id = CheckpointStore.job_id_for(queries, limit=search_limit) if queries else None
+        # 同じ検索リストの分析が実行待ち・実行中の間は、再開もやり直しも受け付けない
+        running_job = get_job_runner().running(checkpoint_id) if checkpoint_id else None
+        pending = store.pending(checkpoint_id) if checkpoint_id and not running_job else {}
+        
+        start_clicked = st.button("分析を開始する", key="comp_btn")
+        resume_clicked = False
+        if running_job:
+            st.info("同じ検索リストの分析を実行中です。完了するまで新しく開始できません。")
+        elif pending:
+            st.info(f"同じ検索リストの中断された分析があります (検索 {pending.get('search', 0)}件 / 店舗 {pending.get('shop', 0)}件 取得済み)")
+            resume_clicked = st.button("前回の続きから再開する", key="comp_resume_btn")
         
-        if st.button("分析を開始する", key="comp_btn"):
+        if start_clicked or resume_clicked:
             if not input_text.strip():
                 st.warning("キーワードが入力されていません。")
             else:
-                target_list = [{'query': line.strip()} for line in input_text.split('\n') if line.strip()]
-                status_text = st.empty()
-                progress_bar = st.progress(0)
-                
                 try:
-                    sheet1_data = []
-                    analyzed_shops = set()
-                    
-                    # Search
-                    total = len(target_list)
-                    for i, target in enumerate(target_list):
-                        q = target['query']
-                        status_text.text(f"検索中 ({i+1}/{total}): {q}")
-                        items = search_items(q, limit=10)
-                        sheet1_data.extend(items)
-                        for item in items:
-                            if item['ショップコード'] not in analyzed_shops:
-                                analyzed_shops.add(item['ショップコード'])
-                        progress_bar.progress(int((i+1) / total * 40))
-
-                    # Shop Analysis
-                    sheet2_data = []
-                    total_shops = len(analyzed_shops)
-                    status_text.text(f"店舗詳細分析中... (全{total_shops}店舗)")
-                    shop_map = {row['ショップコード']: row['ショップ名'] for row in sheet1_data}
-                    
-                    for i, s_code in enumerate(analyzed_shops):
-                        s_name = shop_map.get(s_code, "不明")
-                        shop_items = get_shop_top_items(s_code, s_name, limit=30)
-                        sheet2_data.extend(shop_items)
-                        current_progress = 40 + int((i+1) / max(1, total_shops) * 60)
-                        progress_bar.progress(min(100, current_progress))
-
-                    status_text.text("Excel生成中...")
-                    df1 = pd.DataFrame(sheet1_data)
-                    df2 = pd.DataFrame(sheet2_data)
-                    
-                    output = io.BytesIO()
-                    if not df1.empty: df1 = df1.sort_values(by='推定累積売上', ascending=False)
-                    cols1 = ['検索タイプ', '検索条件', '商品名', '価格', 'レビュー総数', '推定累積販売数', '推定累積売上', 'ポイント倍率', 'クーポン有無', 'ショップ名', '商品URL']
-                    df1 = df1.reindex(columns=cols1) if not df1.empty else pd.DataFrame()
-                    
-                    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                        if not df1.empty:
-                            df1.to_excel(writer, sheet_name='検索結果', index=False)
-                            format_worksheet(writer.sheets['検索結果'])
-                        if not df2.empty:
-                            df2.to_excel(writer, sheet_name='店舗分析', index=False)
-                            format_worksheet(writer.sheets['店舗分析'])
-                    
-                    progress_bar.progress(100)
-                    status_text.success("分析完了！")
-                    
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M')
-                    st.download_button(
-                        label="📊 分析結果Excelをダウンロード",
-                        data=output.getvalue(),
-                        file_name=f"rakuten_analysis_{timestamp}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
+                    job = get_job_runner().submit(
+                        "競合分析", competitor_job, queries, fmt=EXPORT_FORMATS[comp_format], key=checkpoint_id,
+                        resume=resume_clicked, refresh=force_refresh, max_shops=max_shops or None, limit=search_limit)
+                    st.session_state["comp_job"] = job.id
+                    st.session_state["comp_job_format"] = comp_format
+                except JobBusyError:
+                    st.warning("同じ検索リストの分析を実行中のため開始できません。完了後にもう一度お試しください。")
+
+        def render_comp_result(result):
+            st.success("分析完了！")
+            if result["cache"]:
+                cs = result["cache"]
+                st.caption(f"APIキャッシュ (この分析): ヒット {cs['hits']} / ミス {cs['misses']} (キャッシュ全体の保存 {cs['entries']}件)")
+            ss = result["shops"]
+            st.caption(f"店舗: 全{ss['shops']}店舗 / 新規取得 {ss['fetched']} / 保存済み利用 {ss['reused']} / 上限で省略 {ss['skipped']}")
+            if ss["failed_queries"] or ss["failed_shops"]:
+                st.warning(f"取り直しても取得できなかったため空欄になっています: 検索 {len(ss['failed_queries'])}件 / 店舗 {len(ss['failed_shops'])}件"
+                           "。同じ検索リストで「前回の続きから再開する」と取得できなかった分だけ再取得できます。")
+            if ss["rejected_queries"] or ss["rejected_shops"]:
+                st.info(f"APIがエラー(400/404など)を返したため空欄になっています: 検索 {len(ss['rejected_queries'])}件 / 店舗 {len(ss['rejected_shops'])}件")
+            
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M')
+            st.download_button(
+                label=f"📊 分析結果をダウンロード ({st.session_state['comp_job_format']})",
+                data=result["data"],
+                file_name=f"rakuten_analysis_{timestamp}.{result['ext']}",
+                mime=result["mime"]
+            )
+        job_panel("comp_job", render_comp_result, "エラーが発生しました")
+
+        with st.expander("📈 推移分析 (過去の取得結果との比較)"):
+            st.markdown("分析のたびに記録した価格・レビュー数から、前回との差分を店舗別・商品別に集計します。")
+            trend_since = st.date_input("集計開始日", value=None, key="trend_since")
+            if st.button("推移を集計する", key="trend_btn"):
+                try:
+                    since = trend_since.strftime("%Y-%m-%d") if trend_since else None
+                    trend_tables = build_trend_tables(get_snapshot_store(), since=since)
+                    if trend_tables['店舗別推移'].empty:
+                        st.warning("比較できる履歴がまだありません。同じキーワードで2回以上分析すると表示されます。")
+                    else:
+                        st.dataframe(trend_tables['店舗別推移'])
+                        trend_data, trend_ext, trend_mime = export_tables(trend_tables, "xlsx")
+                        st.download_button(
+                            label="📈 推移データをダウンロード (Excel)",
+                            data=trend_data,
+                            file_name=f"rakuten_trends_{datetime.now().strftime('%Y%m%d_%H%M')}.{trend_ext}",
+                            mime=trend_mime
+                        )
                 except Exception as e:
                     st.error(f"エラーが発生しました: {e}")
 
@@ -329,119 +159,108 @@ def main():
             min_cpc = c2.number_input("最低入札単価 (円)", min_value=10, value=25)
             max_cpc = c3.number_input("最高入札単価 (円)", min_value=10, value=100)
             skip_rows_num = c4.number_input("ヘッダー開始行", min_value=1, value=7)
+            rpp_format = st.radio("出力形式", list(EXPORT_FORMATS), horizontal=True, key="rpp_format")
 
         if st.button("価格取得＆改善実行", key="rpp_btn"):
             if not uploaded_file or not my_shop_code:
                 st.error("ファイルと自店舗IDは必須です。")
             else:
                 try:
-                    df_rpp = None
                     skip_rows_count = skip_rows_num - 1 
-
-                    if uploaded_file.name.endswith('.xlsx') or uploaded_file.name.endswith('.xls'):
-                        uploaded_file.seek(0)
-                        try:
-                            df_rpp = pd.read_excel(uploaded_file, skiprows=skip_rows_count)
-                        except: pass
-                    else:
-                        encodings = ['shift_jis', 'cp932', 'utf-8', 'utf-8-sig']
-                        for enc in encodings:
-                            try:
-                                uploaded_file.seek(0)
-                                df_rpp = pd.read_csv(uploaded_file, encoding=enc, skiprows=skip_rows_count)
-                                if len(df_rpp.columns) > 1: break
-                            except: continue
+                    df_rpp = load_rpp_report(uploaded_file, uploaded_file.name, skip_rows_count)
                     
                     if df_rpp is None:
                         st.error(f"読み込み失敗。ヘッダー開始行({skip_rows_num}行目)の設定を確認してください。")
                         st.stop()
                     
-                    req_cols = [
-                        "商品管理番号", "入札単価", "CTR(%)", "商品CPC", "クリック数(合計)", 
-                        "実績額(合計)", "CPC実績(合計)", "売上金額(合計720時間)", 
-                        "売上件数(合計720時間)", "CVR(合計720時間)(%)", "ROAS(合計720時間)(%)", 
-                        "注文獲得単価(合計720時間)"
-                    ]
-                    
                     if "商品管理番号" not in df_rpp.columns:
                         st.error(f"CSVの中に「商品管理番号」列が見つかりません。")
                         st.stop()
                     
                     st.write(f"データ件数: {len(df_rpp)}件")
-                    progress_rpp = st.progress(0)
-                    results_rpp = []
-                    total_rows = len(df_rpp)
-                    
-                    for index, row in df_rpp.iterrows():
-                        progress_rpp.progress((index + 1) / total_rows)
-                        
-                        item_manage_number = str(row.get("商品管理番号", "")).strip()
-                        if not item_manage_number or item_manage_number.lower() == 'nan': continue
-                        
-                        current_bid = clean_number(row.get("入札単価"), 25)
-                        actual_cpc = clean_number(row.get("CPC実績(合計)"), 25)
-                        roas = clean_number(row.get("ROAS(合計720時間)(%)"), 0)
-                        clicks = int(clean_number(row.get("クリック数(合計)"), 0))
-                        
-                        current_price, status_msg = get_current_price_for_rpp(item_manage_number, my_shop_code)
-                        time.sleep(0.3)
-                        
-                        base_cpc = current_bid if current_bid > 0 else actual_cpc
-                        new_bid = base_cpc
-                        reason = "維持"
-                        
-                        if roas == 0 and clicks > 20:
-                            new_bid = max(min_cpc, base_cpc - 10)
-                            reason = "クリック過多・売上なし"
-                        elif 0 < roas < target_roas:
-                            new_bid = max(min_cpc, base_cpc - 5)
-                            reason = "ROAS低・抑制"
-                        elif roas > (target_roas + 200):
-                            new_bid = min(max_cpc, base_cpc + 10)
-                            reason = "ROAS好調・強化"
-                        
-                        row_data = {
-                            "商品管理番号": item_manage_number,
-                            "現在価格": current_price if current_price else "取得失敗",
-                            "APIステータス": status_msg,
-                            "推奨入札単価": int(new_bid),
-                            "変更理由": reason
-                        }
-                        for col in req_cols:
-                            if col != "商品管理番号":
-                                row_data[col] = row.get(col, "")
-                                
-                        results_rpp.append(row_data)
-                    
-                    if not results_rpp:
-                        st.warning("処理データなし")
-                    else:
-                        first_cols = ["商品管理番号", "現在価格", "推奨入札単価", "変更理由", "入札単価", "APIステータス"]
-                        other_cols = [c for c in req_cols if c not in ["商品管理番号", "入札単価"]]
-                        final_cols = first_cols + other_cols
-                        
-                        df_res = pd.DataFrame(results_rpp)
-                        existing_cols = [c for c in final_cols if c in df_res.columns]
-                        df_res = df_res[existing_cols]
-                        
-                        st.success("完了！")
-                        st.dataframe(df_res)
-                        
-                        output = io.BytesIO()
-                        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                            df_res.to_excel(writer, sheet_name='RPP改善案', index=False)
-                            format_worksheet(writer.sheets['RPP改善案'])
-                        
-                        st.download_button(
-                            label="推奨CPCリストをダウンロード (Excel)",
-                            data=output.getvalue(),
-                            file_name='rpp_optimized_v7.xlsx',
-                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                        )
+                    job = get_job_runner().submit(
+                        "RPP改善", rpp_job, df_rpp, my_shop_code, target_roas, min_cpc, max_cpc,
+                        fmt=EXPORT_FORMATS[rpp_format])
+                    st.session_state["rpp_job"] = job.id
+                    st.session_state["rpp_job_format"] = rpp_format
 
                 except Exception as e:
                     st.error(f"予期せぬエラー: {e}")
 
+        def render_rpp_result(result):
+            df_res = result["table"]
+            if df_res.empty:
+                st.warning("処理データなし")
+                return
+            st.success("完了！")
+            st.dataframe(df_res)
+            
+            st.download_button(
+                label=f"推奨CPCリストをダウンロード ({st.session_state['rpp_job_format']})",
+                data=result["data"],
+                file_name=f'rpp_optimized_v7.{result["ext"]}',
+                mime=result["mime"]
+            )
+        job_panel("rpp_job", render_rpp_result, "予期せぬエラー")
+
+        # 複数店舗まとめて実行 (ファイルごとに店舗IDを割り当てる)
+        st.divider()
+        st.subheader("🏬 複数店舗まとめて最適化")
+        st.markdown("店舗ごとのRPP実績ファイルをまとめてアップロードし、それぞれに店舗IDを割り当ててください。"
+                    "詳細設定は上と共通です。店舗ごとのシートとサマリーを1つのファイルにまとめます。")
+        multi_files = st.file_uploader("RPP実績ファイル (複数可)", type=['csv', 'xlsx', 'xls'], accept_multiple_files=True, key="rpp_multi_files")
+        shop_by_file = {}
+        if multi_files:
+            mapping = st.data_editor(
+                pd.DataFrame({"ファイル名": [f.name for f in multi_files], "店舗ID": [guess_shop_code(f.name) for f in multi_files]}),
+                disabled=["ファイル名"], hide_index=True, key="rpp_multi_mapping")
+            shop_by_file = {name: str(code).strip() for name, code in zip(mapping["ファイル名"], mapping["店舗ID"]) if str(code).strip()}
+        m1, m2 = st.columns(2)
+        multi_workers = m1.number_input("同時に処理する店舗数", min_value=1, max_value=10, value=RPP_SHOP_WORKERS, key="rpp_multi_workers")
+        multi_format = m2.selectbox("出力形式", list(EXPORT_FORMATS), key="rpp_multi_format")
+
+        if st.button("🏬 全店舗の価格取得＆改善実行", key="rpp_multi_btn"):
+            if not multi_files:
+                st.error("RPP実績ファイルをアップロードしてください。")
+            elif len(shop_by_file) < len(multi_files):
+                st.error("すべてのファイルに店舗IDを入力してください。")
+            elif len({code.casefold() for code in shop_by_file.values()}) < len(shop_by_file):
+                st.error("店舗IDが重複しています。1店舗につき1ファイルにしてください。")
+            else:
+                reports, problems = {}, []
+                for f in multi_files:
+                    df_rpp = load_rpp_report(f, f.name, skip_rows_num - 1)
+                    if df_rpp is None:
+                        problems.append(f"{f.name}: 読み込み失敗 (ヘッダー開始行 {skip_rows_num}行目)")
+                    elif "商品管理番号" not in df_rpp.columns:
+                        problems.append(f"{f.name}: 「商品管理番号」列が見つかりません")
+                    else:
+                        reports[shop_by_file[f.name]] = df_rpp
+                for msg in problems: st.error(msg)
+                if reports and not problems:
+                    st.write(f"{len(reports)}店舗 / データ件数: {sum(len(df) for df in reports.values())}件")
+                    job = get_job_runner().submit(
+                        "RPP改善 (複数店舗)", rpp_multi_job, reports, target_roas, min_cpc, max_cpc,
+                        fmt=EXPORT_FORMATS[multi_format], shop_workers=multi_workers)
+                    st.session_state["rpp_multi_job"] = job.id
+                    st.session_state["rpp_multi_job_format"] = multi_format
+
+        def render_rpp_multi_result(result):
+            df_summary = result["table"]
+            failed = (df_summary["エラー"] != "").sum()
+            if failed:
+                st.warning(f"{failed}店舗は改善案を作成できませんでした (サマリーのエラー列を確認してください)")
+            else:
+                st.success("完了！")
+            st.dataframe(df_summary, hide_index=True)
+            st.download_button(
+                label=f"全店舗の推奨CPCリストをダウンロード ({st.session_state['rpp_multi_job_format']})",
+                data=result["data"],
+                file_name=f'rpp_optimized_shops_{datetime.now().strftime("%Y%m%d_%H%M")}.{result["ext"]}',
+                mime=result["mime"]
+            )
+        job_panel("rpp_multi_job", render_rpp_multi_result, "予期せぬエラー")
+
     # -----------------------------------
     # Tab 3: ブログ自動生成
     # -----------------------------------
@@ -452,6 +271,10 @@ def main():
         # 設定エリア
         with st.expander("設定 (Gemini API Key)", expanded=True):
             gemini_key = st.text_input("Google Gemini API Key", type="password", key="blog_gemini_key")
+            g1, g2 = st.columns(2)
+            image_max_edge = g1.number_input("送信画像の長辺 (px)", min_value=256, max_value=4096, value=BLOG_IMAGE_MAX_EDGE, step=128, key="blog_max_edge",
+                                             help="アップロード画像を縮小・EXIF除去してから送信します")
+            image_format = g2.selectbox("送信画像の形式", ["JPEG", "WEBP"], key="blog_image_format")
 
         col1, col2 = st.columns([1, 1])
         
@@ -462,7 +285,7 @@ def main():
             keywords = st.text_area("キーワード・ターゲット", height=100, 
                                     placeholder="例：\n30代女性、北欧インテリア\n癒やし、ドライフラワー、プレゼント", key="blog_kw")
             
-            tone = st.selectbox("記事の雰囲気", ["親しみやすい・共感", "高級感・プロフェッショナル", "シンプル・ミニマル", "情熱的・セールス強め"], key="blog_tone")
+            tone = st.selectbox("記事の雰囲気", BLOG_TONES, key="blog_tone")
 
             if uploaded_img:
                 st.image(uploaded_img, caption="対象の商品画像", use_column_width=True)
@@ -478,8 +301,8 @@ def main():
                 else:
                     try:
                         with st.spinner("画像を見て、記事を書いています...（約30秒）"):
-                            # 画像データの準備
-                            img = Image.open(uploaded_img)
+                            # 画像データの準備 (縮小・再エンコードは1回だけ行い、モデルの切り替え時も使い回す)
+                            img = preprocess_image(uploaded_img.getvalue(), max_edge=image_max_edge, fmt=image_format)
                             
                             # AI実行
                             result_text = generate_blog_content(gemini_key, img, keywords, tone)
@@ -494,5 +317,81 @@ def main():
                     except Exception as e:
                         st.error(f"エラーが発生しました: {e}")
 
+        # まとめて生成 (画像zip + キーワードCSV)
+        st.divider()
+        st.subheader("📦 まとめて生成 (バッチ)")
+        st.markdown("商品画像のzipと、`ファイル名,キーワード,トーン` 形式のCSVをアップロードすると、まとめて記事を作成します。ファイル名はzip内のパス (例: `a/main.jpg`) かファイル名で指定します。生成済みの組み合わせは再生成しません。")
+        b1, b2 = st.columns(2)
+        batch_zip = b1.file_uploader("商品画像 (zip)", type=['zip'], key="blog_batch_zip")
+        batch_csv = b2.file_uploader("キーワードCSV (任意)", type=['csv'], key="blog_batch_csv")
+        b3, b4, b5, b6 = st.columns(4)
+        batch_workers = b3.number_input("同時実行数", min_value=1, max_value=10, value=BLOG_WORKERS, key="blog_batch_workers")
+        batch_qps = b4.number_input("秒間リクエスト上限", min_value=0.1, value=BLOG_QPS, step=0.5, key="blog_batch_qps")
+        batch_backend = b5.selectbox("モデル", ["Gemini", "スタブ (オフライン検証用)"], key="blog_batch_backend")
+        batch_format = b6.selectbox("出力形式", list(EXPORT_FORMATS), key="blog_batch_format")
+
+        if st.button("📦 まとめて生成する", key="blog_batch_btn"):
+            if batch_backend == "Gemini" and not gemini_key:
+                st.error("設定エリアにGemini APIキーを入力してください。")
+            elif not batch_zip:
+                st.error("商品画像のzipをアップロードしてください。")
+            else:
+                try:
+                    entries = load_blog_batch(batch_zip.getvalue(), batch_csv.getvalue() if batch_csv else None,
+                                              default_keywords=keywords, default_tone=tone)
+                    if not entries:
+                        st.warning("zipの中に画像が見つかりません。")
+                    else:
+                        backend = GeminiBackend(gemini_key) if batch_backend == "Gemini" else StubBackend()
+                        job = get_job_runner().submit(
+                            "ブログ一括生成", blog_batch_job, entries, backend, fmt=EXPORT_FORMATS[batch_format],
+                            max_workers=batch_workers, qps=batch_qps, max_edge=image_max_edge, image_format=image_format)
+                        st.session_state["blog_job"] = job.id
+                        st.session_state["blog_job_format"] = batch_format
+                except Exception as e:
+                    st.error(f"エラーが発生しました: {e}")
+
+        def render_blog_result(result):
+            df_blog = result["table"]
+            counts = df_blog["ステータス"].value_counts()
+            st.success(f"生成完了！ (新規 {counts.get('生成', 0)}件 / キャッシュ {counts.get('キャッシュ', 0)}件 / エラー {counts.get('エラー', 0)}件)")
+            st.dataframe(df_blog[["ファイル名", "キーワード", "トーン", "ステータス"]])
+            st.download_button(
+                label=f"📦 記事をまとめてダウンロード ({st.session_state['blog_job_format']})",
+                data=result["data"],
+                file_name=f"blog_articles_{datetime.now().strftime('%Y%m%d_%H%M')}.{result['ext']}",
+                mime=result["mime"]
+            )
+        job_panel("blog_job", render_blog_result, "エラーが発生しました")
+
+    # ==========================================
+    # 診断情報 (処理段階ごとの時間・API呼び出し・握りつぶしたエラー)
+    # ==========================================
+    with st.expander("🩺 診断情報"):
+        snap = METRICS.snapshot()
+        st.caption(f"集計開始: {datetime.fromtimestamp(snap['started_at']).strftime('%Y-%m-%d %H:%M:%S')}")
+        if snap["stages"]:
+            df_stages = pd.DataFrame([
+                {"段階": name, "回数": st_["count"], "合計(秒)": round(st_["seconds"], 3),
+                 "平均(秒)": round(st_["seconds"] / st_["count"], 4), "最大(秒)": round(st_["max"], 3)}
+                for name, st_ in snap["stages"].items()]).sort_values("合計(秒)", ascending=False)
+            st.dataframe(df_stages, hide_index=True)
+        if snap["calls"]:
+            st.dataframe(pd.DataFrame([
+                {"エンドポイント": name, "呼び出し": call["count"], "平均レイテンシ(秒)": round(call["seconds"] / call["count"], 3)}
+                for name, call in snap["calls"].items()]), hide_index=True)
+            st.dataframe(pd.DataFrame(snap["statuses"]), hide_index=True)
+        if snap["errors"]:
+            st.warning("握りつぶされた例外があります")
+            st.dataframe(pd.DataFrame(snap["errors"]), hide_index=True)
+        if snap["events"]:
+            st.json(snap["events"])
+        c1, c2, c3 = st.columns(3)
+        c1.download_button("JSONで保存", METRICS.to_json(), file_name="metrics.json", mime="application/json")
+        c2.download_button("Prometheus形式で保存", METRICS.to_prometheus(), file_name="metrics.prom", mime="text/plain")
+        if c3.button("リセット"):
+            METRICS.reset()
+            st.rerun()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,218 @@
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from rakuten_core import (
+    APP_ID, METRICS, RPP_COLUMNS, IchibaClient, run_competitor_analysis, build_competitor_tables,
+    resolve_rpp_prices, load_rpp_report, recommend_bids, export_tables,
+)
+
+# ==========================================
+# オフラインベンチマーク (mock_server.py を相手に競合分析・RPP改善を計測)
+#   python benchmark.py                                  # 10/100/1000件の競合分析 + 1万/10万行のRPP
+#   python benchmark.py --scales 10 100 --rpp-rows 50000 --latency 0.1 --throttle-rate 0.05
+#   python benchmark.py --output bench.json              # 結果を保存
+#   python benchmark.py --baseline bench.json            # 保存した結果より遅い・重い場合は終了コード1
+# ==========================================
+
+DEFAULT_SCALES = [10, 100, 1000]   # 競合分析の検索語数
+DEFAULT_RPP_ROWS = [10000, 100000] # 合成RPPレポートの行数
+RPP_SHOP = "bench-shop"
+RPP_UNKNOWN_ITEMS = 200  # 合成RPPレポートのうちカタログにない商品数 (個別検索にまわる)
+MIN_REGRESSION = {"wall_seconds": 0.5, "peak_mb": 10.0}  # これ未満の悪化は誤差として扱う
+
+def log(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+def start_mock_server(args):
+    """mock_server.py を子プロセスで起動し (プロセス, URL) を返す。計測に待ち受け側の負荷が混ざらないよう別プロセスにする。"""
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_server.py"),
+           "--port", "0", "--latency", str(args.latency), "--jitter", str(args.jitter),
+           "--error-rate", str(args.error_rate), "--throttle-rate", str(args.throttle_rate),
+           "--shop-items", str(args.shop_items), "--seed", "0"]
+    if args.max_qps: cmd += ["--max-qps", str(args.max_qps)]
+    if args.recordings: cmd += ["--recordings", args.recordings]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    url = proc.stdout.readline().strip()
+    if not url:
+        proc.kill()
+        raise RuntimeError("モックサーバーを起動できませんでした")
+    return proc, url
+
+def synthetic_rpp_report(rows, shop_items):
+    """RPP実績レポートと同じ形式(先頭6行は説明、cp932)の合成CSVを作る"""
+    rng = np.random.default_rng(0)
+    n = np.arange(rows) % (shop_items + RPP_UNKNOWN_ITEMS)
+    clicks = rng.integers(0, 200, rows)
+    df = pd.DataFrame({
+        "商品管理番号": [f"item-{i:05d}" for i in n],
+        "入札単価": rng.integers(25, 100, rows),
+        "CTR(%)": (rng.random(rows) * 3).round(2),
+        "商品CPC": rng.integers(25, 100, rows),
+        "クリック数(合計)": clicks,
+        "実績額(合計)": [f"{v:,}" for v in clicks * 40],
+        "CPC実績(合計)": rng.integers(20, 120, rows),
+        "売上金額(合計720時間)": [f"{v:,}" for v in rng.integers(0, 300000, rows)],
+        "売上件数(合計720時間)": rng.integers(0, 50, rows),
+        "CVR(合計720時間)(%)": (rng.random(rows) * 10).round(2),
+        "ROAS(合計720時間)(%)": rng.choice([0, 150, 350, 500, 800], rows),
+        "注文獲得単価(合計720時間)": rng.integers(0, 5000, rows),
+    }, columns=RPP_COLUMNS)
+    return ("RPPレポート(ベンチマーク)\n" * 6 + df.to_csv(index=False)).encode("cp932")
+
+def run_competitor(client, scale, limit):
+    queries = [f"ベンチマーク {i}" for i in range(scale)]
+    sheet1_data, sheet2_data = run_competitor_analysis(queries, client=client, limit=limit)
+    export_tables(build_competitor_tables(sheet1_data, sheet2_data), "xlsx")
+    return {"rows": len(sheet1_data) + len(sheet2_data)}
+
+def run_rpp(client, rows, shop_items):
+    report = synthetic_rpp_report(rows, shop_items)
+    df_rpp = load_rpp_report(io.BytesIO(report), "bench.csv", 6)
+    numbers = df_rpp["商品管理番号"].astype(str).str.strip().tolist()
+    price_map = resolve_rpp_prices(numbers, RPP_SHOP, client=client)
+    df_res = recommend_bids(df_rpp, 400, 25, 100, price_map=price_map)
+    export_tables({'RPP改善案': df_res}, "xlsx")
+    return {"rows": len(df_res)}
+
+def _rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+class PeakMemory:
+    """実行中のメモリ増加量のピークを測る。
+    rssは常駐メモリを一定間隔で読む (Linuxのみ、負荷が小さい)。tracemallocはPythonの確保を正確に追うが処理が数倍遅くなる。"""
+    def __init__(self, mode="rss", interval=0.02):
+        if mode == "rss" and not os.path.exists("/proc/self/statm"): mode = "tracemalloc"
+        self.mode = mode
+        self.interval = interval
+        self.peak = 0
+
+    def __enter__(self):
+        if self.mode == "tracemalloc":
+            tracemalloc.start()
+            return self
+        self.base = _rss_bytes()
+        self.stopped = threading.Event()
+        def sample():
+            while not self.stopped.is_set():
+                self.peak = max(self.peak, _rss_bytes() - self.base)
+                self.stopped.wait(self.interval)
+        self.thread = threading.Thread(target=sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.mode == "tracemalloc":
+            self.peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            self.stopped.set()
+            self.thread.join()
+            self.peak = max(self.peak, _rss_bytes() - self.base)
+
+def measure(name, func, memory="rss"):
+    """funcを実行し、経過時間・API呼び出し数・メモリ増加量のピークを返す"""
+    METRICS.reset()
+    with PeakMemory(memory) as mem:
+        start = time.perf_counter()
+        extra = func()
+        wall = time.perf_counter() - start
+    peak = mem.peak
+    snap = METRICS.snapshot()
+    requests_made = sum(c["count"] for c in snap["calls"].values())
+    statuses = {}
+    for row in snap["statuses"]:
+        statuses[row["status"]] = statuses.get(row["status"], 0) + row["count"]
+    result = {
+        "scenario": name, "wall_seconds": round(wall, 3), "requests": requests_made,
+        "requests_per_sec": round(requests_made / wall, 1) if wall > 0 else 0.0,
+        "peak_mb": round(peak / 1024 / 1024, 1), "statuses": statuses,
+        "errors": sum(e["count"] for e in snap["errors"]), **extra,
+    }
+    log(f"{name}: {result['wall_seconds']}秒 / {requests_made}リクエスト ({result['requests_per_sec']}/秒) / ピーク {result['peak_mb']}MB")
+    return result
+
+def compare(results, baseline, tolerance):
+    """ベースラインより tolerance 以上遅い・メモリが多いシナリオを返す"""
+    base = {r["scenario"]: r for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        b = base.get(r["scenario"])
+        if not b: continue
+        for key in ("wall_seconds", "peak_mb"):
+            if r[key] > b[key] * (1 + tolerance) and r[key] - b[key] > MIN_REGRESSION[key]:
+                regressions.append(f"{r['scenario']} {key}: {b[key]} → {r[key]}")
+    return regressions
+
+def print_table(results):
+    df = pd.DataFrame(results)[["scenario", "wall_seconds", "requests", "requests_per_sec", "peak_mb", "errors", "rows"]]
+    print(df.rename(columns={
+        "scenario": "シナリオ", "wall_seconds": "経過(秒)", "requests": "リクエスト", "requests_per_sec": "リクエスト/秒",
+        "peak_mb": "ピーク(MB)", "errors": "エラー", "rows": "行数"}).to_string(index=False))
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="モックAPIを使ったオフラインベンチマーク")
+    parser.add_argument("--scales", type=int, nargs="*", default=DEFAULT_SCALES, help="競合分析の検索語数")
+    parser.add_argument("--rpp-rows", type=int, nargs="*", default=DEFAULT_RPP_ROWS, help="合成RPPレポートの行数")
+    parser.add_argument("--limit", type=int, default=10, help="1キーワードあたりの取得件数")
+    parser.add_argument("--workers", type=int, default=8, help="同時リクエスト数")
+    parser.add_argument("--rate", type=float, default=200.0, help="クライアントの秒間リクエスト上限")
+    parser.add_argument("--url", help="起動済みのモックサーバーのURL (省略時は子プロセスで起動)")
+    parser.add_argument("--latency", type=float, default=0.02, help="モックの平均遅延(秒)")
+    parser.add_argument("--jitter", type=float, default=0.01, help="モックの遅延のばらつき(±秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="モックが500を返す割合")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="モックが429を返す割合")
+    parser.add_argument("--max-qps", type=float, help="モックの秒間受付上限 (超過分は429)")
+    parser.add_argument("--shop-items", type=int, default=3000, help="モックの1店舗あたりの商品数")
+    parser.add_argument("--recordings", help="モックで再生する記録済み応答 (JSON Lines)")
+    parser.add_argument("--memory", choices=["rss", "tracemalloc"], default="rss", help="メモリの測り方 (tracemallocは正確だが遅い)")
+    parser.add_argument("--output", help="結果をJSONで保存するパス")
+    parser.add_argument("--baseline", help="比較するベンチマーク結果 (JSON)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="ベースラインからの許容悪化率")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    proc = None
+    url = args.url
+    if not url:
+        proc, url = start_mock_server(args)
+    log(f"モックサーバー: {url}")
+    try:
+        client = IchibaClient(APP_ID, max_workers=args.workers, rate=args.rate, api_url=url)
+        results = []
+        for scale in args.scales:
+            results.append(measure(f"competitor-{scale}", lambda: run_competitor(client, scale, args.limit), args.memory))
+        for rows in args.rpp_rows:
+            results.append(measure(f"rpp-{rows}", lambda: run_rpp(client, rows, args.shop_items), args.memory))
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+    print_table(results)
+    report = {"created_at": time.strftime("%Y-%m-%d %H:%M:%S"), "options": vars(args), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        log(f"出力: {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            log("ベースラインより悪化しています:")
+            for line in regressions: log(f"  {line}")
+            return 1
+        log("ベースラインとの差は許容範囲内です。")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
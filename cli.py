@@ -0,0 +1,220 @@
+import argparse
+import os
+import sys
+from rakuten_core import (
+    APP_ID, MAX_WORKERS, RATE_LIMIT_PER_SEC, IchibaClient, ResponseCache, CheckpointStore, JobBusyError, ShopProfileStore,
+    SnapshotStore, run_competitor_analysis, build_competitor_tables, build_trend_tables, resolve_rpp_prices,
+    load_rpp_report, recommend_bids, export_tables, BLOG_TONES, BLOG_WORKERS, BLOG_QPS, BLOG_IMAGE_MAX_EDGE,
+    GeminiBackend, StubBackend, BlogCache, load_blog_batch, generate_blog_batch, METRICS,
+    RPP_SHOP_WORKERS, RPP_SUMMARY_SHEET, optimize_rpp_shops, guess_shop_code,
+)
+
+# ==========================================
+# バッチ実行用CLI (Streamlitなしで競合分析・RPP改善を実行)
+#   python cli.py analyze --keywords keywords.txt --output out.xlsx
+#   python cli.py rpp --report rpp.csv --shop lykke-hygge --output rpp.xlsx
+#   python cli.py rpp-multi --report a.csv=shop-a --report b.csv=shop-b --output rpp_shops.xlsx
+#   python cli.py trends --output trends.xlsx --since 2024-01-01
+#   python cli.py blog --images images.zip --keywords keywords.csv --output articles.xlsx
+# ==========================================
+
+OUTPUT_FORMATS = {".xlsx": "xlsx", ".csv": "csv", ".parquet": "parquet"}
+
+def log(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+def make_client(args):
+    return IchibaClient(args.app_id, max_workers=args.workers, rate=args.rate, cache=ResponseCache(), api_url=args.api_url)
+
+def write_output(sheets, output, fmt=None):
+    fmt = fmt or OUTPUT_FORMATS.get(os.path.splitext(output)[1].lower(), "xlsx")
+    data, ext, _ = export_tables(sheets, fmt)
+    # CSV/Parquetで複数シートの場合はzipになるため拡張子を合わせる
+    path = output if output.lower().endswith("." + ext) else os.path.splitext(output)[0] + "." + ext
+    with open(path, "wb") as f:
+        f.write(data)
+    log(f"出力: {path}")
+    return path
+
+def cmd_analyze(args):
+    with open(args.keywords, encoding="utf-8-sig") as f:
+        queries = [line.strip() for line in f if line.strip()]
+    if not queries:
+        log("キーワードが入力されていません。")
+        return 1
+
+    client = make_client(args)
+    store = CheckpointStore() if not args.no_checkpoint else None
+    def on_progress(phase, done, total):
+        log(f"{'検索' if phase == 'search' else '店舗分析'} {done}/{total}")
+    stats = {}
+    try:
+        sheet1_data, sheet2_data = run_competitor_analysis(
+            queries, client=client, store=store, resume=args.resume,
+            refresh=args.refresh, on_progress=on_progress,
+            shops=ShopProfileStore(), max_shops=args.max_shops, stats=stats, limit=args.limit,
+            snapshots=SnapshotStore())
+    except JobBusyError:
+        log("同じキーワードリストの分析を別のプロセスが実行中です。完了後に実行してください。")
+        return 1
+    if stats["failed_queries"] or stats["failed_shops"]:
+        log(f"取得できなかった検索 {len(stats['failed_queries'])}件 / 店舗 {len(stats['failed_shops'])}件 (--resume で再取得できます)")
+    if stats["rejected_queries"] or stats["rejected_shops"]:
+        log(f"APIがエラー(400/404など)を返した検索 {len(stats['rejected_queries'])}件 / 店舗 {len(stats['rejected_shops'])}件")
+    write_output(build_competitor_tables(sheet1_data, sheet2_data), args.output, args.format)
+    return 0
+
+def cmd_rpp(args):
+    with open(args.report, "rb") as f:
+        df_rpp = load_rpp_report(f, os.path.basename(args.report), args.header_row - 1)
+    if df_rpp is None:
+        log(f"読み込み失敗。ヘッダー開始行({args.header_row}行目)の設定を確認してください。")
+        return 1
+    if "商品管理番号" not in df_rpp.columns:
+        log("レポートの中に「商品管理番号」列が見つかりません。")
+        return 1
+
+    client = make_client(args)
+    numbers = [str(v).strip() for v in df_rpp["商品管理番号"]]
+    numbers = [n for n in numbers if n and n.lower() != 'nan']
+    log(f"データ件数: {len(df_rpp)}件 / 価格取得中...")
+    price_map = resolve_rpp_prices(numbers, args.shop, client=client)
+    df_res = recommend_bids(df_rpp, args.target_roas, args.min_cpc, args.max_cpc, price_map=price_map)
+    if df_res.empty:
+        log("処理データなし")
+        return 1
+    write_output({'RPP改善案': df_res}, args.output, args.format)
+    return 0
+
+def cmd_rpp_multi(args):
+    reports = {}
+    for spec in args.report:
+        # PATH=店舗ID (店舗IDを省略するとファイル名から推測)
+        path, _, shop = spec.partition("=")
+        shop = shop.strip() or guess_shop_code(path)
+        if shop.casefold() in {s.casefold() for s in reports}:
+            log(f"店舗IDが重複しています: {shop}")
+            return 1
+        with open(path, "rb") as f:
+            df_rpp = load_rpp_report(f, os.path.basename(path), args.header_row - 1)
+        if df_rpp is None or "商品管理番号" not in df_rpp.columns:
+            log(f"{path}: 読み込み失敗。ヘッダー開始行({args.header_row}行目)と「商品管理番号」列を確認してください。")
+            return 1
+        reports[shop] = df_rpp
+        log(f"{path} → {shop} ({len(df_rpp)}件)")
+
+    def on_done(done, total, shop_code):
+        log(f"{done}/{total}店舗完了 ({shop_code})")
+    sheets = optimize_rpp_shops(reports, args.target_roas, args.min_cpc, args.max_cpc,
+                                client=make_client(args), shop_workers=args.shop_workers, on_done=on_done)
+    write_output(sheets, args.output, args.format)
+    return 0 if (sheets[RPP_SUMMARY_SHEET]["エラー"] == "").all() else 1
+
+def cmd_trends(args):
+    sheets = build_trend_tables(SnapshotStore(), since=args.since)
+    if sheets['店舗別推移'].empty:
+        log("比較できる履歴がまだありません。")
+        return 1
+    write_output(sheets, args.output, args.format)
+    return 0
+
+def cmd_blog(args):
+    entries = load_blog_batch(args.images, args.keywords, default_keywords=args.default_keywords, default_tone=args.tone)
+    if not entries:
+        log("画像が見つかりません。")
+        return 1
+    if args.backend == "stub":
+        backend = StubBackend()
+    else:
+        api_key = args.api_key or os.environ.get("GEMINI_API_KEY")
+        if not api_key:
+            log("Gemini APIキーを --api-key か環境変数 GEMINI_API_KEY で指定してください。")
+            return 1
+        backend = GeminiBackend(api_key)
+    def on_done(done, total):
+        log(f"記事生成 {done}/{total}")
+    df = generate_blog_batch(entries, backend, cache=BlogCache(), max_workers=args.blog_workers, qps=args.qps, on_done=on_done,
+                             max_edge=args.max_edge, image_format=args.image_format)
+    write_output({'ブログ記事': df}, args.output, args.format)
+    return 0 if (df["ステータス"] != "エラー").all() else 1
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="EC運営支援ツール バッチ実行")
+    parser.add_argument("--app-id", default=APP_ID, help="楽天アプリID")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="同時リクエスト数")
+    parser.add_argument("--rate", type=float, default=RATE_LIMIT_PER_SEC, help="秒間リクエスト上限 (プロセスごと)")
+    parser.add_argument("--api-url", help="APIのURL (mock_server.pyで検証する場合に指定)")
+    parser.add_argument("--metrics", help="計測値の出力先 (.jsonはJSON、.prom/.txtはPrometheus形式)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("analyze", help="競合分析")
+    p.add_argument("--keywords", required=True, help="検索リスト (1行1件: キーワード/JAN/URL)")
+    p.add_argument("--output", required=True, help="出力ファイル (.xlsx/.csv/.parquet)")
+    p.add_argument("--format", choices=sorted(set(OUTPUT_FORMATS.values())), help="出力形式 (省略時は拡張子から判定)")
+    p.add_argument("--refresh", action="store_true", help="キャッシュを使わず最新データを取得する")
+    p.add_argument("--resume", action="store_true", help="同じ検索リストの中断された分析を再開する")
+    p.add_argument("--no-checkpoint", action="store_true", help="チェックポイントを保存しない")
+    p.add_argument("--limit", type=int, default=10, help="1キーワードあたりの取得件数 (30件超はページ分割して取得)")
+    p.add_argument("--max-shops", type=int, help="1回の店舗取得上限 (検索ヒット数の多い店舗を優先)")
+    p.set_defaults(func=cmd_analyze)
+
+    p = sub.add_parser("rpp", help="RPP入札単価の最適化")
+    p.add_argument("--report", required=True, help="RPP実績ファイル (CSV/Excel)")
+    p.add_argument("--shop", required=True, help="自店舗ID (URLの英数字)")
+    p.add_argument("--output", required=True, help="出力ファイル (.xlsx/.csv/.parquet)")
+    p.add_argument("--format", choices=sorted(set(OUTPUT_FORMATS.values())), help="出力形式 (省略時は拡張子から判定)")
+    p.add_argument("--target-roas", type=float, default=400, help="目標ROAS (%%)")
+    p.add_argument("--min-cpc", type=int, default=25, help="最低入札単価 (円)")
+    p.add_argument("--max-cpc", type=int, default=100, help="最高入札単価 (円)")
+    p.add_argument("--header-row", type=int, default=7, help="ヘッダー開始行")
+    p.set_defaults(func=cmd_rpp)
+
+    p = sub.add_parser("rpp-multi", help="複数店舗のRPP入札単価をまとめて最適化")
+    p.add_argument("--report", required=True, action="append", help="RPP実績ファイルと店舗ID (PATH=店舗ID、繰り返し指定。店舗ID省略時はファイル名から推測)")
+    p.add_argument("--output", required=True, help="出力ファイル (.xlsx/.csv/.parquet)")
+    p.add_argument("--format", choices=sorted(set(OUTPUT_FORMATS.values())), help="出力形式 (省略時は拡張子から判定)")
+    p.add_argument("--target-roas", type=float, default=400, help="目標ROAS (%%)")
+    p.add_argument("--min-cpc", type=int, default=25, help="最低入札単価 (円)")
+    p.add_argument("--max-cpc", type=int, default=100, help="最高入札単価 (円)")
+    p.add_argument("--header-row", type=int, default=7, help="ヘッダー開始行")
+    p.add_argument("--shop-workers", type=int, default=RPP_SHOP_WORKERS, help="同時に処理する店舗数")
+    p.set_defaults(func=cmd_rpp_multi)
+
+    p = sub.add_parser("trends", help="過去の取得結果との差分 (店舗別・商品別の推移)")
+    p.add_argument("--output", required=True, help="出力ファイル (.xlsx/.csv/.parquet)")
+    p.add_argument("--format", choices=sorted(set(OUTPUT_FORMATS.values())), help="出力形式 (省略時は拡張子から判定)")
+    p.add_argument("--since", help="集計開始日 (YYYY-MM-DD)")
+    p.set_defaults(func=cmd_trends)
+
+    p = sub.add_parser("blog", help="ブログ記事のまとめて生成")
+    p.add_argument("--images", required=True, help="商品画像のフォルダまたはzip")
+    p.add_argument("--keywords", help="キーワードCSV (ファイル名,キーワード[,トーン])")
+    p.add_argument("--output", required=True, help="出力ファイル (.xlsx/.csv/.parquet)")
+    p.add_argument("--format", choices=sorted(set(OUTPUT_FORMATS.values())), help="出力形式 (省略時は拡張子から判定)")
+    p.add_argument("--default-keywords", default="", help="CSVに行のない画像のキーワード")
+    p.add_argument("--tone", choices=BLOG_TONES, default=BLOG_TONES[0], help="CSVで指定のない画像のトーン")
+    p.add_argument("--backend", choices=["gemini", "stub"], default="gemini", help="生成モデル (stubはオフライン検証用)")
+    p.add_argument("--api-key", help="Gemini APIキー (省略時は環境変数 GEMINI_API_KEY)")
+    p.add_argument("--blog-workers", type=int, default=BLOG_WORKERS, help="同時実行数")
+    p.add_argument("--qps", type=float, default=BLOG_QPS, help="秒間リクエスト上限")
+    p.add_argument("--max-edge", type=int, default=BLOG_IMAGE_MAX_EDGE, help="送信画像の長辺 (px)")
+    p.add_argument("--image-format", choices=["JPEG", "WEBP"], default="JPEG", help="送信画像の形式")
+    p.set_defaults(func=cmd_blog)
+    return parser
+
+def write_metrics(path):
+    text = METRICS.to_prometheus() if os.path.splitext(path)[1].lower() in (".prom", ".txt") else METRICS.to_json()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    log(f"計測値: {path}")
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    finally:
+        if args.metrics:
+            write_metrics(args.metrics)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+import requests
+
+# ==========================================
+# 楽天市場API (IchibaItem/Search) のローカル代替サーバー
+#   python mock_server.py --port 8080 --latency 0.05 --error-rate 0.01 --throttle-rate 0.02
+#   RAKUTEN_API_URL=http://127.0.0.1:8080/ python cli.py analyze ...
+# 記録済みの応答(JSON Lines)があれば再生し、なければ検索条件から決まる合成データを返す。
+# --upstream を付けると記録にない要求だけ本物のAPIへ中継し、応答を --recordings に追記する。
+# ==========================================
+
+DEFAULT_SHOPS = 200        # 合成データの店舗数
+DEFAULT_SHOP_ITEMS = 3000  # 合成データの1店舗あたりの商品数 (カタログ取得は100ページ×30件が上限)
+DEFAULT_SEARCH_HITS = 300  # 合成データの1キーワードあたりのヒット数
+IGNORED_PARAMS = ("applicationId",)  # 記録の照合に使わないパラメータ
+
+def request_key(params):
+    """記録の照合キー (アプリIDを除き、順序に依存しない)"""
+    return json.dumps({k: str(v) for k, v in params.items() if k not in IGNORED_PARAMS}, sort_keys=True, ensure_ascii=False)
+
+def _seed(*parts):
+    return int(hashlib.md5("|".join(map(str, parts)).encode("utf-8")).hexdigest()[:8], 16)
+
+class SyntheticCatalog:
+    """検索条件から毎回同じ結果になる合成商品データ"""
+    def __init__(self, shops=DEFAULT_SHOPS, shop_items=DEFAULT_SHOP_ITEMS, search_hits=DEFAULT_SEARCH_HITS):
+        self.shops = shops
+        self.shop_items = shop_items
+        self.search_hits = search_hits
+
+    def item(self, shop_code, n):
+        h = _seed(shop_code, n)
+        return {"Item": {
+            "itemName": f"ベンチマーク商品 {shop_code} {n:05d}" + (" クーポン" if h % 7 == 0 else ""),
+            "catchcopy": "期間限定SALE" if h % 11 == 0 else "",
+            "itemCode": f"{shop_code}:item-{n:05d}",
+            "itemPrice": 500 + h % 20000,
+            "reviewCount": h % 5000,
+            "pointRate": 1 + h % 10,
+            "shopName": f"ベンチマーク店 {shop_code}",
+            "shopCode": shop_code,
+            "itemUrl": f"https://item.rakuten.co.jp/{shop_code}/item-{n:05d}/",
+            "genreId": str(100000 + h % 50),
+        }}
+
+    def page(self, items_total, hits, page, make):
+        page_count = max(1, min(100, -(-items_total // hits)))
+        start = (page - 1) * hits
+        items = [make(i) for i in range(start, min(start + hits, items_total))] if page <= page_count else []
+        return {"count": items_total, "page": page, "hits": hits, "pageCount": page_count, "Items": items}
+
+    def respond(self, params):
+        hits = max(1, min(30, int(params.get("hits", 30))))
+        page = max(1, int(params.get("page", 1)))
+        shop_code = params.get("shopCode")
+        keyword = params.get("keyword", "")
+        if shop_code and keyword:
+            # 商品管理番号での価格確認 (item-NNNNN の番号が店舗の商品数未満なら該当あり)
+            n = int(keyword.rsplit("-", 1)[-1]) if keyword.rsplit("-", 1)[-1].isdigit() else -1
+            total = 1 if 0 <= n < self.shop_items else 0
+            return self.page(total, hits, page, lambda i: self.item(shop_code, n))
+        if shop_code:
+            return self.page(self.shop_items, hits, page, lambda i: self.item(shop_code, i))
+        def make(i):
+            h = _seed(keyword, i)
+            return self.item(f"shop-{h % self.shops:04d}", h % self.shop_items)
+        return self.page(self.search_hits, hits, page, make)
+
+class MockRakutenServer(ThreadingHTTPServer):
+    """遅延・エラー・429(スロットリング)を設定できる楽天API代替サーバー"""
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, max_qps=None,
+                 recordings=None, upstream=None, catalog=None, seed=None):
+        super().__init__(address, MockHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_qps = max_qps
+        self.upstream = upstream
+        self.recordings_path = recordings
+        self.catalog = catalog or SyntheticCatalog()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recorded = {}
+        self.window = []  # 直近1秒の受付時刻 (max_qps判定用)
+        self.stats = {}
+        if recordings:
+            try:
+                with open(recordings, encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            rec = json.loads(line)
+                            self.recorded[request_key(rec["params"])] = rec["response"]
+            except FileNotFoundError:
+                pass
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def decide(self):
+        """この要求を 200 / 429 / 500 のどれで返すか決める"""
+        with self.lock:
+            now = time.monotonic()
+            if self.max_qps:
+                self.window = [t for t in self.window if now - t < 1.0]
+                if len(self.window) >= self.max_qps: return 429
+                self.window.append(now)
+            r = self.random.random()
+            if r < self.throttle_rate: return 429
+            if r < self.throttle_rate + self.error_rate: return 500
+            return 200
+
+    def delay(self):
+        with self.lock:
+            d = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if d > 0: time.sleep(d)
+
+    def lookup(self, params):
+        key = request_key(params)
+        if key in self.recorded: return self.recorded[key], "replay"
+        if self.upstream:
+            res = requests.get(self.upstream, params=params, timeout=10)
+            data = res.json()
+            if res.status_code == 200:
+                self.record(params, data)
+            return data, "upstream"
+        return self.catalog.respond(params), "synthetic"
+
+    def record(self, params, data):
+        with self.lock:
+            self.recorded[request_key(params)] = data
+            if self.recordings_path:
+                with open(self.recordings_path, "a", encoding="utf-8") as f:
+                    params = {k: v for k, v in params.items() if k not in IGNORED_PARAMS}
+                    f.write(json.dumps({"params": params, "response": data}, ensure_ascii=False) + "\n")
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-aliveでクライアントのコネクションプールを効かせる
+
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429: self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        server = self.server
+        if url.path == "/__stats":
+            with server.lock:
+                return self.send_json(200, dict(server.stats))
+        if url.path == "/__reset":
+            with server.lock:
+                server.stats.clear()
+            return self.send_json(200, {})
+
+        params = dict(parse_qsl(url.query))
+        server.count("requests")
+        server.delay()
+        status = server.decide()
+        server.count(str(status))
+        if status == 429:
+            return self.send_json(429, {"error": "too_many_requests", "error_description": "number of allowed requests has been exceeded for this API. please try again soon."})
+        if status == 500:
+            return self.send_json(500, {"error": "system_error", "error_description": "api logic error"})
+        try:
+            data, source = server.lookup(params)
+        except Exception as e:
+            server.count("upstream_error")
+            return self.send_json(502, {"error": "upstream_error", "error_description": str(e)})
+        server.count(source)
+        self.send_json(200, data)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_server(port=0, host="127.0.0.1", **options):
+    """別スレッドでサーバーを起動して返す (終了は server.shutdown())"""
+    server = MockRakutenServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="楽天市場API代替サーバー (オフライン検証・ベンチマーク用)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080, help="待ち受けポート (0で空きポート)")
+    parser.add_argument("--latency", type=float, default=0.05, help="応答までの平均遅延(秒)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="遅延のばらつき(±秒)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500を返す割合")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="429を返す割合")
+    parser.add_argument("--max-qps", type=float, help="秒間の受付上限 (超過分は429)")
+    parser.add_argument("--recordings", help="記録済み応答 (JSON Lines: {params, response})")
+    parser.add_argument("--upstream", help="記録にない要求の中継先 (本物のAPIのURL)。応答は --recordings に追記する")
+    parser.add_argument("--shops", type=int, default=DEFAULT_SHOPS, help="合成データの店舗数")
+    parser.add_argument("--shop-items", type=int, default=DEFAULT_SHOP_ITEMS, help="合成データの1店舗あたりの商品数")
+    parser.add_argument("--search-hits", type=int, default=DEFAULT_SEARCH_HITS, help="合成データの1キーワードあたりのヒット数")
+    parser.add_argument("--seed", type=int, help="遅延・エラーの乱数シード")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    server = MockRakutenServer(
+        (args.host, args.port), latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate, max_qps=args.max_qps, recordings=args.recordings, upstream=args.upstream,
+        catalog=SyntheticCatalog(args.shops, args.shop_items, args.search_hits), seed=args.seed)
+    # 起動したURLは標準出力の1行目に出す (ベンチマークから子プロセスで起動する場合に読む)
+    print(server.url, flush=True)
+    print(f"記録済み応答: {len(server.recorded)}件 / 統計: {server.url}__stats / 終了は Ctrl+C", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
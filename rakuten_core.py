@@ -0,0 +1,1836 @@
+import requests
+import pandas as pd
+import pyarrow as pa
+import numpy as np
+import time
+import random
+import threading
+import sqlite3
+import json
+import hashlib
+import os
+import glob
+from datetime import datetime
+import uuid
+import socket
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from urllib.parse import urlparse
+import io
+import re
+import zipfile
+from array import array
+from requests.adapters import HTTPAdapter
+from openpyxl import load_workbook
+import xlsxwriter
+
+# ▼▼▼ 設定エリア (楽天) ▼▼▼
+APP_ID = '1052224946268447244' 
+REVIEW_RATE = 0.08  
+PRICE_UPLIFT = 1.2  
+API_URL = os.environ.get("RAKUTEN_API_URL", "https://app.rakuten.co.jp/services/api/IchibaItem/Search/20170706")  # モックサーバーで検証する場合は差し替え
+MAX_WORKERS = 4          # 同時リクエスト数
+RATE_LIMIT_PER_SEC = 2.0 # アプリIDあたりの秒間リクエスト上限
+RATE_MIN_PER_SEC = 0.2   # 429が続いたときに下げる秒間リクエスト数の下限
+RATE_DECREASE = 0.5      # 429を受けたときに秒間リクエスト数に掛ける係数 (乗算的減少)
+RATE_INCREASE = 0.2      # 成功が続いたときに1秒あたり戻す秒間リクエスト数 (加算的増加)
+RATE_DECREASE_INTERVAL = 1.0  # 同時に返ってきた429でまとめて下げすぎないよう、減少はこの間隔(秒)に1回まで
+RETRY_STATUSES = (429, 500, 502, 503, 504)  # 再試行するHTTPステータス
+RETRY_MAX = 4            # 1リクエストあたりの再試行回数
+RETRY_BASE_DELAY = 0.5   # 再試行の初回待ち時間(秒)。回数ごとに倍にし、0〜その値でランダムに待つ
+RETRY_MAX_DELAY = 30.0   # 再試行の待ち時間の上限(秒)
+REQUEUE_ROUNDS = 2       # 失敗した検索語・店舗を実行の最後に取り直す回数
+REQUEUE_DELAY = 2.0      # 取り直しの前に待つ時間(秒)
+CACHE_PATH = os.path.join(".cache", "rakuten_api.sqlite3")
+CACHE_TTL = {"search": 6 * 3600, "shop": 12 * 3600, "catalog": 3600}  # エンドポイント別の有効期限(秒)
+CACHE_MAX_BYTES = 200 * 1024 * 1024                   # 超過時は最終参照が古い順に削除
+JOB_DB_PATH = os.path.join(".cache", "jobs.sqlite3")
+JOB_RETENTION_DAYS = 7  # 再開用チェックポイントの保存期間
+SHOP_DB_PATH = os.path.join(".cache", "shop_profiles.sqlite3")
+SHOP_PROFILE_TTL = 12 * 3600  # 店舗プロフィール(上位商品)をそのまま再利用する期間(秒)
+SNAPSHOT_DIR = os.path.join(".cache", "snapshots")  # 取得商品の履歴 (日付パーティションのParquet)
+BLOG_DB_PATH = os.path.join(".cache", "blog.sqlite3")
+BLOG_WORKERS = 3         # ブログ記事のバッチ生成の同時実行数
+BLOG_QPS = 1.0           # ブログ記事のバッチ生成の秒間リクエスト上限
+BLOG_STUB_DELAY = 0.5    # スタブモデルの応答時間(秒)
+BLOG_IMAGE_MAX_EDGE = 1024  # モデルに送る画像の長辺の上限(px)
+BLOG_IMAGE_FORMAT = "JPEG"  # モデルに送る画像の形式 (JPEG / WEBP)
+BLOG_IMAGE_QUALITY = 85     # 再エンコード時の画質
+BLOG_IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp')
+BLOG_TONES = ["親しみやすい・共感", "高級感・プロフェッショナル", "シンプル・ミニマル", "情熱的・セールス強め"]
+JOB_WORKERS = 4         # 画面から投入した分析を同時に実行する数 (全ユーザー共通)
+JOB_KEEP_SECONDS = 3600 # 完了したバックグラウンドジョブの結果を保持する時間
+SEARCH_PAGE_HITS = 30      # 深い検索での1ページ件数 (API上限)
+SEARCH_MAX_PAGES = 100     # 深い検索での最大ページ数 (API上限)
+SEARCH_DEPTHS = [10, 30, 90, 150, 300]  # 画面で選べる1キーワードあたりの取得件数
+CATALOG_HITS = 30       # 店舗カタログ取得時の1ページ件数 (API上限)
+CATALOG_MAX_PAGES = 100 # 店舗カタログ取得時の最大ページ数 (API上限)
+RPP_CSV_CHUNK_ROWS = 50000    # CSV・xlsxを分割して読む行数
+RPP_TEXT_COLUMNS = ("商品管理番号",)  # RPPレポートで数値にしない列 (それ以外は読み込み時に数値化する)
+RPP_SNIFF_BYTES = 64 * 1024   # 文字コード判定に使う先頭サンプルのサイズ
+RPP_SHOP_WORKERS = 4          # 複数店舗のRPP改善で同時に処理する店舗数 (通信は全店舗共通のクライアントで制限)
+RPP_SUMMARY_SHEET = "サマリー"
+RPP_SUMMARY_COLUMNS = ["店舗ID", "シート名", "商品数", "価格取得成功", "強化", "抑制", "維持", "平均入札単価", "平均推奨入札単価",
+                       "実績額(合計)", "売上金額(合計720時間)", "ROAS(%)", "エラー"]
+RPP_SUMMARY_COUNT_COLS = ["商品数", "価格取得成功", "強化", "抑制", "維持", "実績額(合計)", "売上金額(合計720時間)"]
+EXPORT_FORMATS = {"Excel (.xlsx)": "xlsx", "CSV": "csv", "Parquet": "parquet"}
+EXPORT_MIME = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv", "parquet": "application/octet-stream", "zip": "application/zip",
+}
+COUPON_KEYWORDS = ["クーポン", "OFF", "値引", "SALE"]  # 商品名・キャッチコピーにあれば「クーポン有」とする語
+ITEM_CATEGORY_COLS = ["ショップ名", "ショップコード", "ジャンルID", "クーポン有無", "検索条件", "検索タイプ", "対象店舗"]  # カテゴリ型で持つ列
+ITEM_STRING_COLS = ["商品名", "商品URL"]  # Arrow文字列で持つ列
+XLSX_MAX_URLS = 65530  # Excelの1シートあたりのハイパーリンク上限
+NUM_COLS = ["価格", "レビュー総数", "推定累積販売数", "推定累積売上", 
+            "現在価格", "入札単価", "推奨入札単価", "商品CPC", "クリック数(合計)", 
+            "実績額(合計)", "CPC実績(合計)", "売上金額(合計720時間)", "売上件数(合計720時間)", "注文獲得単価(合計720時間)"]
+RPP_COLUMNS = [
+    "商品管理番号", "入札単価", "CTR(%)", "商品CPC", "クリック数(合計)", 
+    "実績額(合計)", "CPC実績(合計)", "売上金額(合計720時間)", 
+    "売上件数(合計720時間)", "CVR(合計720時間)(%)", "ROAS(合計720時間)(%)", 
+    "注文獲得単価(合計720時間)"
+]
+
+# ==========================================
+# 共通・ロジック関数群 (楽天)
+# ==========================================
+
+class TokenBucket:
+    """トークンバケット方式のレート制限 (スレッドセーフ)。
+    429を受けるとrateを下げ(乗算的減少)、成功が続くと設定値まで少しずつ戻す(加算的増加)。"""
+    def __init__(self, rate, capacity=None, min_rate=RATE_MIN_PER_SEC):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.decreased_at = 0.0
+        self.lock = threading.Lock()
+
+    def on_throttle(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.tokens, 0.0)  # 待機中の他スレッドも一緒に間隔を空ける
+            if now - self.decreased_at < RATE_DECREASE_INTERVAL: return
+            self.decreased_at = now
+            self.rate = max(self.min_rate, self.rate * RATE_DECREASE)
+        METRICS.incr("rate.decrease")
+
+    def on_success(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                # 1リクエストごとにRATE_INCREASE/rateずつ戻すと、1秒あたりおよそRATE_INCREASE戻る
+                self.rate = min(self.max_rate, self.rate + RATE_INCREASE / self.rate)
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class Metrics:
+    """処理段階ごとの所要時間、APIエンドポイントごとの呼び出し数・レイテンシ分布・ステータス、握りつぶした例外を集計する"""
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.stages = {}    # 段階名 -> {"count", "seconds", "max"}
+            self.calls = {}     # エンドポイント -> {"count", "seconds", "buckets"}
+            self.statuses = {}  # (エンドポイント, ステータス) -> 件数
+            self.errors = {}    # (発生箇所, 例外名) -> 件数
+            self.events = {}    # イベント名 -> 件数 (キャッシュヒットなど)
+
+    def observe_stage(self, name, seconds):
+        with self.lock:
+            st = self.stages.setdefault(name, {"count": 0, "seconds": 0.0, "max": 0.0})
+            st["count"] += 1
+            st["seconds"] += seconds
+            st["max"] = max(st["max"], seconds)
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """関数全体の所要時間を段階nameとして記録するデコレータ"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe_call(self, endpoint, seconds, status):
+        """API呼び出し1回分。statusはHTTPステータスコードか、通信例外の名前。"""
+        with self.lock:
+            call = self.calls.setdefault(endpoint, {"count": 0, "seconds": 0.0, "buckets": [0] * len(self.LATENCY_BUCKETS)})
+            call["count"] += 1
+            call["seconds"] += seconds
+            for i, le in enumerate(self.LATENCY_BUCKETS):
+                if seconds <= le: call["buckets"][i] += 1
+            key = (endpoint, str(status))
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def record_error(self, where, exc):
+        with self.lock:
+            key = (where, type(exc).__name__)
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.events[name] = self.events.get(name, 0) + n
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "started_at": self.started_at,
+                "stages": {k: dict(v) for k, v in self.stages.items()},
+                "calls": {k: {**v, "buckets": dict(zip(map(str, self.LATENCY_BUCKETS), v["buckets"]))} for k, v in self.calls.items()},
+                "statuses": [{"endpoint": e, "status": s, "count": n} for (e, s), n in sorted(self.statuses.items())],
+                "errors": [{"where": w, "type": t, "count": n} for (w, t), n in sorted(self.errors.items())],
+                "events": dict(self.events),
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self, prefix="rakutentool"):
+        """Prometheusのテキスト形式で出力する"""
+        def label(v):
+            return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        snap = self.snapshot()
+        lines = [f"# TYPE {prefix}_stage_seconds summary"]
+        for name, st in sorted(snap["stages"].items()):
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{label(name)}"}} {st["seconds"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{label(name)}"}} {st["count"]}')
+        lines.append(f"# TYPE {prefix}_api_request_seconds histogram")
+        for endpoint, call in sorted(snap["calls"].items()):
+            for le, n in call["buckets"].items():
+                lines.append(f'{prefix}_api_request_seconds_bucket{{endpoint="{label(endpoint)}",le="{le}"}} {n}')
+            lines.append(f'{prefix}_api_request_seconds_bucket{{endpoint="{label(endpoint)}",le="+Inf"}} {call["count"]}')
+            lines.append(f'{prefix}_api_request_seconds_sum{{endpoint="{label(endpoint)}"}} {call["seconds"]:.6f}')
+            lines.append(f'{prefix}_api_request_seconds_count{{endpoint="{label(endpoint)}"}} {call["count"]}')
+        lines.append(f"# TYPE {prefix}_api_responses_total counter")
+        for row in snap["statuses"]:
+            lines.append(f'{prefix}_api_responses_total{{endpoint="{label(row["endpoint"])}",status="{label(row["status"])}"}} {row["count"]}')
+        lines.append(f"# TYPE {prefix}_errors_total counter")
+        for row in snap["errors"]:
+            lines.append(f'{prefix}_errors_total{{where="{label(row["where"])}",type="{label(row["type"])}"}} {row["count"]}')
+        lines.append(f"# TYPE {prefix}_events_total counter")
+        for name, n in sorted(snap["events"].items()):
+            lines.append(f'{prefix}_events_total{{event="{label(name)}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()  # プロセス全体で共有する計測値
+
+class RakutenApiError(Exception):
+    """再試行しても200以外が返ったAPI呼び出し"""
+    def __init__(self, status, endpoint=None):
+        super().__init__(f"APIエラー({status})")
+        self.status = status
+        self.endpoint = endpoint
+
+def is_transient_error(e):
+    """取り直せば成功しうる失敗か (429/5xxの応答と通信エラー)。400/404などは何度取り直しても結果が変わらない。"""
+    if isinstance(e, RakutenApiError): return e.status in RETRY_STATUSES
+    return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+def retry_delay(attempt, retry_after=None):
+    """指数バックオフ (フルジッター)。Retry-Afterヘッダーがあればそれ以上待つ (ワーカーを長く塞がないようRETRY_MAX_DELAYまで)。"""
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    try:
+        return min(RETRY_MAX_DELAY, max(delay, float(retry_after))) if retry_after else delay
+    except ValueError:
+        return delay
+
+class ResponseCache:
+    """APIレスポンスのディスクキャッシュ (SQLite / TTL + LRU容量制限)"""
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY, endpoint TEXT, body TEXT, size INTEGER,
+            created_at REAL, accessed_at REAL)""")
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(endpoint, params):
+        # applicationIdを除いたパラメータを正規化してキー化
+        norm = {k: str(v).strip() for k, v in params.items() if k != "applicationId"}
+        raw = endpoint + "|" + json.dumps(norm, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, endpoint, params, with_time=False):
+        """有効期限内ならレスポンスを返す (なければNone)。with_time=Trueでは (レスポンス, 保存時刻) を返す。"""
+        key = self.make_key(endpoint, params)
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT body, created_at FROM responses WHERE key=?", (key,)).fetchone()
+            if row and now - row[1] <= self.ttl.get(endpoint, 0):
+                self.conn.execute("UPDATE responses SET accessed_at=? WHERE key=?", (now, key))
+                self.conn.commit()
+                self.hits += 1
+                return (json.loads(row[0]), row[1]) if with_time else json.loads(row[0])
+            self.misses += 1
+            return None
+
+    def set(self, endpoint, params, data, created_at=None):
+        key = self.make_key(endpoint, params)
+        body = json.dumps(data, ensure_ascii=False)
+        now = time.time()
+        created_at = created_at or now
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                              (key, endpoint, body, len(body.encode("utf-8")), created_at, now))
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes: return
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            self.conn.execute("DELETE FROM responses WHERE key=?", (key,))
+            total -= size
+            if total <= self.max_bytes: break
+
+    def stats(self):
+        with self.lock:
+            count, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            return {"hits": self.hits, "misses": self.misses, "entries": count, "bytes": size}
+
+class IchibaClient:
+    """楽天市場API共通クライアント (コネクションプール + 並列実行 + レート制限)"""
+    def __init__(self, app_id=APP_ID, max_workers=MAX_WORKERS, rate=RATE_LIMIT_PER_SEC, cache=None, api_url=None):
+        self.app_id = app_id
+        self.api_url = api_url or API_URL
+        self.max_workers = max_workers
+        self.cache = cache
+        self.bucket = TokenBucket(rate)
+        # 複数の並列処理から同時に使われても、通信中のリクエストはコネクションプールの大きさまでに抑える
+        self.slots = threading.BoundedSemaphore(max_workers)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, params, timeout=10, endpoint="search"):
+        """429/5xxと通信エラーは指数バックオフで最大RETRY_MAX回再試行する。
+        再試行し尽くした場合は最後のレスポンスを返す (通信エラーは例外のまま送出)。"""
+        for attempt in range(RETRY_MAX + 1):
+            with METRICS.span("api.rate_limit_wait"):
+                self.bucket.acquire()
+            start = time.perf_counter()
+            try:
+                with self.slots:
+                    res = self.session.get(self.api_url, params={"applicationId": self.app_id, **params}, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                METRICS.observe_call(endpoint, time.perf_counter() - start, type(e).__name__)
+                if attempt == RETRY_MAX: raise
+                retry_after = None
+            else:
+                METRICS.observe_call(endpoint, time.perf_counter() - start, res.status_code)
+                if res.status_code not in RETRY_STATUSES:
+                    # 400/404などの失敗で制限を緩めないよう、レートを戻すのは成功応答だけにする
+                    if 200 <= res.status_code < 300: self.bucket.on_success()
+                    return res
+                if attempt == RETRY_MAX: return res
+                if res.status_code == 429: self.bucket.on_throttle()
+                retry_after = res.headers.get("Retry-After")
+            METRICS.incr(f"retry.{endpoint}")
+            with METRICS.span("api.backoff"):
+                time.sleep(retry_delay(attempt, retry_after))
+
+    def get_json(self, params, endpoint="search", timeout=10, refresh=False, with_time=False):
+        """キャッシュ経由でJSONを取得する。refresh=Trueでキャッシュを無視して再取得。
+        with_time=Trueでは (JSON, 取得時刻) を返す。キャッシュから返した場合の取得時刻はキャッシュに保存した時刻。"""
+        if self.cache and not refresh:
+            cached = self.cache.get(endpoint, params, with_time=True)
+            if cached is not None:
+                METRICS.incr(f"cache_hit.{endpoint}")
+                return cached if with_time else cached[0]
+            METRICS.incr(f"cache_miss.{endpoint}")
+        fetched_at = time.time()
+        res = self.get(params, timeout=timeout, endpoint=endpoint)
+        # 429などのエラー応答を「0件」と取り違えないよう例外にする
+        if res.status_code != 200: raise RakutenApiError(res.status_code, endpoint)
+        data = res.json()
+        if self.cache:
+            # キャッシュの保存時刻を取得時刻にそろえ、キャッシュから返した分を新しい観測と取り違えないようにする
+            self.cache.set(endpoint, params, data, created_at=fetched_at)
+        return (data, fetched_at) if with_time else data
+
+    def map(self, func, items, on_done=None, requeue=False, fallback=None):
+        """itemsの各要素にfuncを並列適用し、入力順で結果を返す。
+        on_done(完了数, 全体数) は呼び出し元スレッドで呼ばれるため、Streamlitの描画に使える。
+        requeue=Trueでは一時的な失敗 (is_transient_error) の要素を最後にREQUEUE_ROUNDS回まで取り直し、それでも失敗した要素と
+        取り直しても変わらない失敗 (400/404など) の要素は fallback(要素, 例外) の戻り値にする (fallbackなしなら例外を送出)。"""
+        items = list(items)
+        results = [None] * len(items)
+        if not items: return results
+        pending = list(range(len(items)))
+        done = 0
+        for round_no in range(REQUEUE_ROUNDS + 1 if requeue else 1):
+            if round_no:
+                METRICS.incr("requeue.items", len(pending))
+                time.sleep(REQUEUE_DELAY * round_no)
+            failed = {}
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = {executor.submit(func, items[i]): i for i in pending}
+                for future in as_completed(futures):
+                    i = futures[future]
+                    try:
+                        results[i] = future.result()
+                    except Exception as e:
+                        if not requeue: raise
+                        if is_transient_error(e):
+                            failed[i] = e
+                            continue
+                        METRICS.record_error("requeue.permanent", e)
+                        if fallback is None: raise
+                        results[i] = fallback(items[i], e)
+                    done += 1
+                    if on_done: on_done(done, len(items))
+            pending = sorted(failed)
+            if not pending: break
+        for i in pending:
+            METRICS.record_error("requeue.gave_up", failed[i])
+            if fallback is None: raise failed[i]
+            results[i] = fallback(items[i], failed[i])
+            done += 1
+            if on_done: on_done(done, len(items))
+        return results
+
+class JobBusyError(RuntimeError):
+    """同じ検索リストの分析が実行中・実行待ちのため開始できない"""
+    def __init__(self, key, job=None):
+        super().__init__("同じ検索リストの分析が実行中です")
+        self.key = key
+        self.job = job
+
+class CheckpointStore:
+    """競合分析ジョブのチェックポイント (検索語・店舗ごとの取得結果をSQLiteに逐次保存)。
+    実行中のジョブには実行元 (ホスト名:PID) を記録し、実行元が生きている間は再開・やり直しを受け付けない。"""
+    def __init__(self, path=JOB_DB_PATH, retention_days=JOB_RETENTION_DAYS):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.active = set()  # このプロセスで実行中のジョブ
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY, status TEXT, updated_at REAL, owner TEXT)""")
+        if "owner" not in [r[1] for r in self.conn.execute("PRAGMA table_info(jobs)")]:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS job_results (
+            job_id TEXT, phase TEXT, key TEXT, body TEXT, PRIMARY KEY (job_id, phase, key))""")
+        expired = time.time() - retention_days * 86400
+        self.conn.execute("DELETE FROM job_results WHERE job_id IN (SELECT job_id FROM jobs WHERE updated_at < ?)", (expired,))
+        self.conn.execute("DELETE FROM jobs WHERE updated_at < ?", (expired,))
+        self.conn.commit()
+
+    @staticmethod
+    def job_id_for(queries, **options):
+        raw = json.dumps({"queries": list(queries), **options}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _touch(self, job_id, status):
+        owner = self.owner if job_id in self.active else None
+        self.conn.execute("INSERT OR REPLACE INTO jobs (job_id, status, updated_at, owner) VALUES (?, ?, ?, ?)",
+                          (job_id, status, time.time(), owner))
+
+    def _owner_alive(self, job_id, owner):
+        """実行元が生きているか (このプロセスなら実行中のジョブか、同じホストの他プロセスならプロセスが残っているか)"""
+        if not owner: return False
+        if owner == self.owner: return job_id in self.active
+        host, _, pid = owner.rpartition(":")
+        if host != socket.gethostname() or os.name != "posix": return False
+        try:
+            os.kill(int(pid), 0)
+        except PermissionError:
+            return True
+        except (ProcessLookupError, ValueError):
+            return False
+        return True
+
+    def _busy(self, job_id):
+        row = self.conn.execute("SELECT status, owner FROM jobs WHERE job_id=?", (job_id,)).fetchone()
+        return bool(row) and row[0] == "running" and self._owner_alive(job_id, row[1])
+
+    def start(self, job_id, resume=False):
+        """ジョブの実行を始める。同じジョブを他のワーカーが実行中ならJobBusyErrorを送出する (保存済みの結果は消さない)。"""
+        with self.lock:
+            if self._busy(job_id): raise JobBusyError(job_id)
+            if not resume:
+                self.conn.execute("DELETE FROM job_results WHERE job_id=?", (job_id,))
+            self.active.add(job_id)
+            self._touch(job_id, "running")
+            self.conn.commit()
+
+    def release(self, job_id):
+        """実行を終える (未完了なら再開できる状態で残す)"""
+        with self.lock:
+            self.active.discard(job_id)
+            self.conn.execute("UPDATE jobs SET owner=NULL WHERE job_id=? AND owner=?", (job_id, self.owner))
+            self.conn.commit()
+
+    @contextmanager
+    def running(self, job_id, resume=False):
+        self.start(job_id, resume=resume)
+        try:
+            yield
+        finally:
+            self.release(job_id)
+
+    def save(self, job_id, phase, key, results):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO job_results VALUES (?, ?, ?, ?)",
+                              (job_id, phase, key, results.to_json()))
+            self._touch(job_id, "running")
+            self.conn.commit()
+
+    def load(self, job_id, phase):
+        with self.lock:
+            rows = self.conn.execute("SELECT key, body FROM job_results WHERE job_id=? AND phase=?", (job_id, phase)).fetchall()
+        # 以前の形式で保存された分は読み飛ばし、再開時に取り直す
+        results = {key: ItemColumns.from_json(body) for key, body in rows}
+        return {key: cols for key, cols in results.items() if cols is not None}
+
+    def finish(self, job_id):
+        with self.lock:
+            self.active.discard(job_id)
+            self._touch(job_id, "done")
+            self.conn.commit()
+
+    def pending(self, job_id):
+        """中断された未完了のジョブなら保存済みの件数を {phase: 件数} で返す。
+        再開対象がない場合と、実行元が生きている (まだ実行中の) 場合は空dict。"""
+        with self.lock:
+            row = self.conn.execute("SELECT status, owner FROM jobs WHERE job_id=?", (job_id,)).fetchone()
+            if not row or row[0] == "done" or self._owner_alive(job_id, row[1]): return {}
+            rows = self.conn.execute("SELECT phase, COUNT(*) FROM job_results WHERE job_id=? GROUP BY phase", (job_id,)).fetchall()
+        return dict(rows)
+
+class ShopProfileStore:
+    """店舗ごとの上位商品を取得日時つきで保存し、検索語・実行・ユーザーをまたいで再利用する"""
+    def __init__(self, path=SHOP_DB_PATH, ttl=SHOP_PROFILE_TTL):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS shop_profiles (
+            shop_code TEXT PRIMARY KEY, shop_name TEXT, items TEXT, fetched_at REAL)""")
+        self.conn.commit()
+
+    def load(self, shop_codes):
+        """{店舗コード: {"items": [...], "fetched_at": 取得時刻}} を返す (未保存の店舗は含まない)"""
+        shop_codes = list(shop_codes)
+        profiles = {}
+        with self.lock:
+            # SQLiteのパラメータ数上限を避けるため分割して引く
+            for i in range(0, len(shop_codes), 500):
+                chunk = shop_codes[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT shop_code, items, fetched_at FROM shop_profiles WHERE shop_code IN ({','.join('?' * len(chunk))})",
+                    chunk).fetchall()
+                for code, items, fetched_at in rows:
+                    items = ItemColumns.from_json(items, fetched_at)
+                    if items is not None:  # 以前の形式のプロフィールは未保存扱いにして取り直す
+                        profiles[code] = {"items": items, "fetched_at": fetched_at}
+        return profiles
+
+    def is_fresh(self, profile, now=None):
+        return (now or time.time()) - profile["fetched_at"] <= self.ttl
+
+    def save(self, shop_code, shop_name, items):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO shop_profiles VALUES (?, ?, ?, ?)",
+                              (shop_code, shop_name, items.to_json(), time.time()))
+            self.conn.commit()
+
+@contextmanager
+def file_lock(path):
+    """プロセス間の排他ロック。同じパスをロックしている他のプロセス (CLIのcron実行・画面など) が終わるまで待つ。"""
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            while True:
+                f.seek(0)
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCKは約10秒で諦めるため取れるまで繰り返す
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def _replace_file(path, write):
+    """一時ファイルに書いてから置き換え、途中で止まっても壊れたファイルを残さない"""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+class SnapshotStore:
+    """取得した商品の価格・レビュー数などを日付パーティションのParquetに記録し、前回との差分を増分で計算する。
+    items/date=YYYY-MM-DD/<取得時刻>.parquet に1回の取得分を書き、未処理のファイルだけを差分計算に回す。"""
+    SNAPSHOT_COLS = {"商品URL": "item_key", "商品名": "item_name", "ショップコード": "shop_code", "ショップ名": "shop_name",
+                     "ジャンルID": "genre_id", "価格": "price", "レビュー総数": "review_count", "ポイント倍率": "point_rate"}
+
+    def __init__(self, root=SNAPSHOT_DIR):
+        self.root = root
+        self.lock = threading.Lock()
+        self.state_path = os.path.join(root, "state", "latest.parquet")
+        self.processed_path = os.path.join(root, "state", "processed.json")
+        self.lock_path = os.path.join(root, "state", "update.lock")
+
+    def _partition(self, kind, captured_at):
+        day = datetime.fromtimestamp(captured_at).strftime("%Y-%m-%d")
+        path = os.path.join(self.root, kind, f"date={day}", f"{captured_at:.3f}.parquet")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def record(self, rows, captured_at=None):
+        """商品DataFrame (run_competitor_analysisの結果) を1回分のスナップショットとして保存する。
+        「取得時刻」列があれば商品ごとの観測時刻にし (キャッシュから返した商品は過去の時刻になる)、なければcaptured_atを使う。"""
+        captured_at = captured_at or time.time()
+        df = pd.DataFrame(rows)
+        if df.empty: return None
+        observed = df["取得時刻"].fillna(captured_at) if "取得時刻" in df.columns else captured_at
+        df = df.reindex(columns=list(self.SNAPSHOT_COLS)).rename(columns=self.SNAPSHOT_COLS)
+        df["item_key"] = df["item_key"].astype("string").str.split("?").str[0]
+        df = df.dropna(subset=["item_key"]).drop_duplicates("item_key", keep="last")
+        df["shop_code"] = df["shop_code"].astype("category")
+        df["genre_id"] = df["genre_id"].astype("string")
+        df["captured_at"] = observed if np.isscalar(observed) else observed.loc[df.index]
+        path = self._partition("items", captured_at)
+        df.to_parquet(path, index=False)
+        return path
+
+    def _load_processed(self):
+        if not os.path.exists(self.processed_path): return set()
+        with open(self.processed_path, encoding="utf-8") as f:
+            return set(json.load(f))
+
+    def update_trends(self):
+        """未処理のスナップショットだけを古い順に読み、商品別・店舗別の差分を deltas/ と shop_deltas/ に追記する。
+        処理した件数を返す。状態ファイルの読み書きは他のプロセスと排他にする (cron実行と画面からの集計が重なっても二重に数えない)。"""
+        with self.lock, file_lock(self.lock_path):
+            processed = self._load_processed()
+            files = sorted(glob.glob(os.path.join(self.root, "items", "date=*", "*.parquet")),
+                           key=lambda p: float(os.path.basename(p)[:-len(".parquet")]))
+            new_files = [p for p in files if os.path.relpath(p, self.root) not in processed]
+            if not new_files: return 0
+
+            latest = pd.read_parquet(self.state_path) if os.path.exists(self.state_path) else None
+            for path in new_files:
+                snap = pd.read_parquet(path)
+                if latest is not None and not latest.empty:
+                    self._write_deltas(snap, latest)
+                    # キャッシュ由来で前回より古い観測が来ても、商品ごとに新しいほうを残す
+                    latest = (pd.concat([latest, snap], ignore_index=True).sort_values("captured_at", kind="stable")
+                              .drop_duplicates("item_key", keep="last").reset_index(drop=True))
+                else:
+                    latest = snap
+                processed.add(os.path.relpath(path, self.root))
+
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            latest["shop_code"] = latest["shop_code"].astype("category")
+            _replace_file(self.state_path, lambda tmp: latest.to_parquet(tmp, index=False))
+            def write_processed(tmp):
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(sorted(processed), f)
+            _replace_file(self.processed_path, write_processed)
+            return len(new_files)
+
+    def _write_deltas(self, snap, latest):
+        prev = latest[["item_key", "price", "review_count", "captured_at"]]
+        d = snap.merge(prev, on="item_key", how="inner", suffixes=("", "_prev"))
+        # 前回以降に新しく観測した商品だけを差分にする (キャッシュから返した同じ観測は除く)
+        d = d[d["captured_at"] > d["captured_at_prev"]]
+        if d.empty: return
+        days = (d["captured_at"] - d["captured_at_prev"]) / 86400
+        review_delta = d["review_count"] - d["review_count_prev"]
+        est_sales_delta = review_delta / REVIEW_RATE
+        deltas = pd.DataFrame({
+            "item_key": d["item_key"], "item_name": d["item_name"],
+            "shop_code": d["shop_code"].astype("category"), "shop_name": d["shop_name"],
+            "captured_at": d["captured_at"], "days": days,
+            "price": d["price"], "price_change": d["price"] - d["price_prev"],
+            "price_change_pct": (d["price"] - d["price_prev"]) / d["price_prev"].where(d["price_prev"] != 0) * 100,
+            "review_delta": review_delta,
+            "review_velocity": review_delta / days.where(days > 0),
+            "est_sales_delta": est_sales_delta,
+            "est_sales_amt_delta": est_sales_delta * (d["price"] * PRICE_UPLIFT).astype("int64"),
+        })
+        captured_at = float(snap["captured_at"].max())
+        deltas.to_parquet(self._partition("deltas", captured_at), index=False)
+
+        shop = deltas.groupby("shop_code", observed=True).agg(
+            shop_name=("shop_name", "last"), items=("item_key", "size"),
+            review_delta=("review_delta", "sum"), review_velocity=("review_velocity", "sum"),
+            est_sales_delta=("est_sales_delta", "sum"), est_sales_amt_delta=("est_sales_amt_delta", "sum"),
+            price_change_pct=("price_change_pct", "mean"),
+        ).reset_index()
+        shop["captured_at"] = captured_at
+        shop.to_parquet(self._partition("shop_deltas", captured_at), index=False)
+
+    def load_trends(self, kind="shop_deltas", since=None):
+        """差分を読み込む。kindは "deltas"(商品別) か "shop_deltas"(店舗別)、sinceは "YYYY-MM-DD" 以降に絞る。"""
+        files = []
+        for part in sorted(glob.glob(os.path.join(self.root, kind, "date=*"))):
+            if since and part.rsplit("date=", 1)[-1] < since: continue
+            files.extend(sorted(glob.glob(os.path.join(part, "*.parquet"))))
+        if not files: return pd.DataFrame()
+        return pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+
+class Job:
+    """バックグラウンドで実行中の処理の状態 (進捗・結果はワーカースレッドから更新される)"""
+    def __init__(self, label):
+        self.id = uuid.uuid4().hex
+        self.label = label
+        self.status = "queued"  # queued / running / done / error
+        self.progress = 0.0
+        self.message = "実行待ち..."
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in ("done", "error")
+
+    def update(self, progress=None, message=None):
+        if progress is not None: self.progress = min(1.0, max(0.0, progress))
+        if message is not None: self.message = message
+
+class JobRunner:
+    """共有ワーカープールで長時間の処理を実行し、Jobで進捗を公開する"""
+    def __init__(self, max_workers=JOB_WORKERS, keep_seconds=JOB_KEEP_SECONDS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.keep_seconds = keep_seconds
+        self.jobs = {}
+        self.active = {}  # key (チェックポイントのjob_idなど) → 実行待ち・実行中のJob
+        self.lock = threading.Lock()
+
+    def submit(self, label, func, *args, key=None, **kwargs):
+        """func(job, *args, **kwargs) をワーカーで実行する。戻り値がjob.resultになる。
+        keyを渡すと、同じkeyのジョブが実行待ち・実行中の間はJobBusyErrorを送出して受け付けない。"""
+        job = Job(label)
+        def run():
+            job.status = "running"
+            try:
+                job.result = func(job, *args, **kwargs)
+                job.update(progress=1.0)
+                job.status = "done"
+            except Exception as e:
+                job.error = e
+                job.status = "error"
+            job.finished_at = time.time()
+            if key is not None:
+                with self.lock:
+                    if self.active.get(key) is job: del self.active[key]
+        with self.lock:
+            if key is not None:
+                running = self.active.get(key)
+                if running is not None and not running.finished: raise JobBusyError(key, running)
+                self.active[key] = job
+            self._purge()
+            self.jobs[job.id] = job
+        self.executor.submit(run)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def running(self, key):
+        """keyで投入したジョブが実行待ち・実行中ならそのJobを返す"""
+        with self.lock:
+            job = self.active.get(key)
+            return job if job is not None and not job.finished else None
+
+    def _purge(self):
+        expired = time.time() - self.keep_seconds
+        for job_id in [j.id for j in self.jobs.values() if j.finished and j.finished_at < expired]:
+            del self.jobs[job_id]
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+def _get_shared(key, factory):
+    # プロセス内で1つだけ作って共有する (Streamlitの再実行や複数セッションをまたいで使い回す)
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = factory()
+        return _shared[key]
+
+def get_job_runner():
+    return _get_shared("job_runner", JobRunner)
+
+def get_shop_profile_store():
+    return _get_shared("shop_profile_store", ShopProfileStore)
+
+def get_snapshot_store():
+    return _get_shared("snapshot_store", SnapshotStore)
+
+def get_checkpoint_store():
+    return _get_shared("checkpoint_store", CheckpointStore)
+
+def get_ichiba_client(app_id=APP_ID):
+    # アプリIDごとに1つ共有し、全セッションで同じレート制限とキャッシュを使う
+    return _get_shared(("ichiba_client", app_id), lambda: IchibaClient(app_id, cache=ResponseCache()))
+
+def get_item_key_from_url(url):
+    try:
+        parsed = urlparse(url)
+        path_parts = [p for p in parsed.path.split('/') if p]
+        if len(path_parts) >= 2: return path_parts[-1]
+        return url
+    except: return url
+
+class ItemColumns:
+    """APIの商品JSONを列ごとのバッファに積む (商品ごとのdictは作らず、数値は型付き配列で持つ)。
+    検索語・店舗ごとのバッファはconcatでつなぎ、指標はto_frameで最後に1回だけ列演算で計算する。"""
+    INT_FIELDS = ("itemPrice", "pointRate", "reviewCount")
+    STR_FIELDS = ("itemName", "catchcopy", "shopName", "shopCode", "itemUrl", "genreId", "itemCode")
+
+    def __init__(self):
+        self.ints = {f: array("q") for f in self.INT_FIELDS}
+        self.strs = {f: [] for f in self.STR_FIELDS}
+        self.extra = {}  # 検索条件・対象店舗など、APIの外から付ける列
+        self.fetched_at = array("d")  # APIから取得した時刻 (キャッシュから返した場合はキャッシュの保存時刻)
+
+    def __len__(self):
+        return len(self.ints["itemPrice"])
+
+    def append(self, item, fetched_at=None):
+        for f, buf in self.ints.items(): buf.append(int(item.get(f) or 0))
+        for f, buf in self.strs.items(): buf.append(str(item.get(f) or ""))
+        self.fetched_at.append(time.time() if fetched_at is None else fetched_at)
+
+    def head(self, n):
+        if n >= len(self): return self
+        part = ItemColumns()
+        part.ints = {f: buf[:n] for f, buf in self.ints.items()}
+        part.strs = {f: buf[:n] for f, buf in self.strs.items()}
+        part.extra = {f: buf[:n] for f, buf in self.extra.items()}
+        part.fetched_at = self.fetched_at[:n]
+        return part
+
+    def unique(self):
+        """itemCodeの重複を除く (最初の行を残す。itemCodeのない行はすべて残す)"""
+        seen, keep = set(), []
+        for i, code in enumerate(self.strs["itemCode"]):
+            if code:
+                if code in seen: continue
+                seen.add(code)
+            keep.append(i)
+        if len(keep) == len(self): return self
+        part = ItemColumns()
+        part.ints = {f: array("q", (buf[i] for i in keep)) for f, buf in self.ints.items()}
+        part.strs = {f: [buf[i] for i in keep] for f, buf in self.strs.items()}
+        part.extra = {f: [buf[i] for i in keep] for f, buf in self.extra.items()}
+        part.fetched_at = array("d", (self.fetched_at[i] for i in keep))
+        return part
+
+    def fill(self, **constants):
+        """全行同じ値の列を付ける"""
+        for col, value in constants.items():
+            self.extra[col] = [value] * len(self)
+        return self
+
+    @classmethod
+    def concat(cls, parts):
+        merged = cls()
+        parts = [p for p in parts if p is not None and len(p)]
+        for col in dict.fromkeys(c for p in parts for c in p.extra):
+            merged.extra[col] = []
+        for p in parts:
+            for f, buf in merged.ints.items(): buf.extend(p.ints[f])
+            for f, buf in merged.strs.items(): buf.extend(p.strs[f])
+            for f, buf in merged.extra.items(): buf.extend(p.extra.get(f) or [None] * len(p))
+            merged.fetched_at.extend(p.fetched_at)
+        return merged
+
+    def shops(self):
+        """{店舗コード: 店舗名} と店舗コードごとの件数"""
+        return dict(zip(self.strs["shopCode"], self.strs["shopName"])), Counter(self.strs["shopCode"])
+
+    def to_json(self):
+        return json.dumps({**{f: list(buf) for f, buf in self.ints.items()}, **self.strs, "extra": self.extra,
+                           "fetched_at": list(self.fetched_at)}, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, body, fetched_at=float("nan")):
+        """to_jsonの逆。列形式でない(以前の形式の)データはNoneを返し、取り直しの対象にする。
+        取得時刻を持たない保存分はfetched_atを取得時刻にする (不明ならNaN。スナップショットでは記録時刻で補う)。"""
+        data = json.loads(body)
+        if not isinstance(data, dict): return None
+        cols = cls()
+        cols.ints = {f: array("q", data[f]) for f in cls.INT_FIELDS}
+        n = len(cols.ints["itemPrice"])
+        cols.strs = {f: data.get(f) or [""] * n for f in cls.STR_FIELDS}  # 後から追加した列 (itemCode) は空で補う
+        cols.extra = data.get("extra", {})
+        cols.fetched_at = array("d", data.get("fetched_at") or [fetched_at] * len(cols.ints["itemPrice"]))
+        return cols
+
+    def to_frame(self, with_time=False):
+        """指標を計算した出力用のDataFrameにする。with_time=Trueでは取得時刻の列も付ける (スナップショット用)。"""
+        if not len(self): return pd.DataFrame()
+        items = pd.DataFrame({**{f: np.frombuffer(buf, dtype=np.int64) for f, buf in self.ints.items()}, **self.strs})
+        df = calculate_metrics(items, PRICE_UPLIFT, REVIEW_RATE)
+        for col, values in self.extra.items():
+            df[col] = pd.Categorical(values)
+        if with_time:
+            df["取得時刻"] = np.frombuffer(self.fetched_at, dtype=np.float64)
+        return df
+
+def compact_items(df):
+    """商品DataFrameの重複の多い列(店舗名・ジャンルIDなど)をカテゴリ型、商品名・URLをArrow文字列にする"""
+    dtypes = {c: "category" for c in ITEM_CATEGORY_COLS if c in df.columns and not isinstance(df[c].dtype, pd.CategoricalDtype)}
+    dtypes.update({c: "string[pyarrow]" for c in ITEM_STRING_COLS if c in df.columns})
+    return df.astype(dtypes) if dtypes else df
+
+@METRICS.timed("calculate_metrics")
+def calculate_metrics(items, uplift, rate):
+    """APIの商品列(itemPriceなど)から出力用の指標列を列演算でまとめて計算する"""
+    price = items["itemPrice"]
+    review_count = items["reviewCount"]
+    adj_price = (price * uplift).astype("int64")
+    total_sales_vol = (review_count / rate).astype("int64")
+    total_sales_amt = total_sales_vol * adj_price
+
+    full_text = (items["itemName"] + items["catchcopy"]).str.replace(" ", "", regex=False)
+    has_coupon = full_text.str.contains("|".join(map(re.escape, COUPON_KEYWORDS)), regex=True)
+
+    return compact_items(pd.DataFrame({
+        "商品名": items["itemName"], "価格": price, "ポイント倍率": items["pointRate"],
+        "クーポン有無": np.where(has_coupon, "有", "-"), "レビュー総数": review_count,
+        "推定累積販売数": total_sales_vol, "推定累積売上": total_sales_amt,
+        "ショップ名": items["shopName"], "ショップコード": items["shopCode"],
+        "商品URL": items["itemUrl"], "ジャンルID": items["genreId"],
+    }))
+
+def search_items(query, limit=10, client=None, refresh=False, raise_errors=False):
+    """検索結果の商品をItemColumnsで返す。
+    raise_errors=Trueでは取得失敗を空の結果にせず例外として送出する (呼び出し元で取り直すため)"""
+    client = client or get_ichiba_client()
+    if "http" in query:
+        keyword = get_item_key_from_url(query)
+        search_type = "URL検索"
+    elif query.isdigit() and len(query) > 7:
+        keyword = query
+        search_type = "JAN検索"
+    else:
+        keyword = query
+        search_type = "ワード検索"
+
+    def parse(data, fetched_at):
+        page = ItemColumns()
+        for w in data.get('Items', []):
+            page.append(w['Item'], fetched_at)
+        return page
+
+    # 30件を超える場合は30件ずつのページに分け、2ページ目以降を並列取得する
+    hits = min(limit, SEARCH_PAGE_HITS)
+    params = {"keyword": keyword, "hits": hits, "sort": "-reviewCount", "availability": 1}
+    try:
+        data, fetched_at = client.get_json(params, endpoint="search", timeout=10, refresh=refresh, with_time=True)
+        first = parse(data, fetched_at)
+    except Exception as e:
+        METRICS.record_error("search_items", e)
+        if raise_errors: raise
+        return ItemColumns()
+
+    pages = min(-(-limit // hits), SEARCH_MAX_PAGES, int(data.get('pageCount', 1) or 1))
+    def fetch_page(page):
+        # ページのJSONは届いたワーカー内で小さな列バッファに変換し、その場で捨てる
+        try:
+            return parse(*client.get_json({**params, "page": page}, endpoint="search", timeout=10, refresh=refresh, with_time=True))
+        except Exception as e:
+            METRICS.record_error("search_items.page", e)
+            if raise_errors: raise
+            return ItemColumns()
+    # ページごとのバッファは完了順ではなくページ順につなぎ、レビュー数順の並びを保ったままitemCodeで重複を除いて上位limit件に切る
+    results = ItemColumns.concat([first, *client.map(fetch_page, range(2, pages + 1))])
+    return results.unique().head(limit).fill(検索条件=query, 検索タイプ=search_type)
+
+def get_shop_top_items(shop_code, shop_name, limit=30, client=None, refresh=False, raise_errors=False):
+    client = client or get_ichiba_client()
+    params = {"shopCode": shop_code, "hits": limit, "sort": "-reviewCount", "availability": 1}
+    try:
+        data, fetched_at = client.get_json(params, endpoint="shop", timeout=10, refresh=refresh, with_time=True)
+        results = ItemColumns()
+        for w in data.get('Items', []):
+            results.append(w['Item'], fetched_at)
+        return results.fill(対象店舗=shop_name)
+    except Exception as e:
+        METRICS.record_error("get_shop_top_items", e)
+        if raise_errors: raise
+        return ItemColumns()
+
+def normalize_manage_number(val):
+    key = str(val).strip()
+    if ":" in key:
+        key = key.split(":")[-1]
+    return key.lower()
+
+def run_competitor_analysis(queries, client=None, store=None, resume=False, refresh=False, on_progress=None,
+                            shops=None, max_shops=None, stats=None, limit=10, snapshots=None):
+    """検索→店舗分析を実行し、商品DataFrameの組 (sheet1_data, sheet2_data) を返す。
+    storeを渡すと検索語・店舗ごとの結果を取得直後に保存し、resume=Trueで保存済みの分は再取得しない。
+    shops(ShopProfileStore)を渡すと鮮度内の店舗は再取得せず、古い店舗を検索ヒット数の多い順に最大max_shops件だけ取り直す。
+    on_progress(フェーズ, 完了数, 全体数) は呼び出し元スレッドで呼ばれる。statsにdictを渡すと店舗取得の内訳と
+    取り直しても取得できなかった検索語・店舗 (failed_queries / failed_shops)、400/404などで取得できない検索語・店舗
+    (rejected_queries / rejected_shops) を書き込む。failedが残ったときだけジョブを未完了のままにする。
+    limitは1検索語あたりの取得件数 (30件を超えるとページ分割して取得)。
+    snapshots(SnapshotStore)を渡すと、この実行で取得した商品(再利用した店舗プロフィールを除く)を履歴に記録する。"""
+    client = client or get_ichiba_client()
+    queries = list(queries)
+    job_id = CheckpointStore.job_id_for(queries, limit=limit)
+    # 同じジョブを他のワーカーが実行中ならJobBusyError。終了時は未完了でも実行元の記録を外し、再開できるようにする
+    with store.running(job_id, resume=resume) if store else nullcontext():
+        failed = {"search": [], "shop": []}
+        rejected = {"search": [], "shop": []}
+
+        def run_phase(phase, keys, fetch):
+            done = store.load(job_id, phase) if store and resume else {}
+            todo = [k for k in keys if k not in done]
+            def task(key):
+                results = fetch(key)
+                # 空の結果は通信失敗と区別できないため保存せず、再開時に取り直す
+                if store and len(results): store.save(job_id, phase, key, results)
+                return results
+            skipped = len(keys) - len(todo)
+            report = (lambda n, total: on_progress(phase, skipped + n, len(keys))) if on_progress else None
+            if report and skipped: report(0, len(todo))
+            # 失敗した検索語・店舗は最後に取り直し、それでも取れなければ空として記録する。
+            # 400/404などは再開しても取れないため、未完了扱いにはしない
+            def give_up(key, e):
+                (failed if is_transient_error(e) else rejected)[phase].append(key)
+                return ItemColumns()
+            done.update(zip(todo, client.map(task, todo, on_done=report, requeue=True, fallback=give_up)))
+            return [done[k] for k in keys]
+
+        # Search
+        with METRICS.span("competitor.search"):
+            found = ItemColumns.concat(run_phase("search", queries, lambda q: search_items(q, limit=limit, client=client, refresh=refresh, raise_errors=True)))
+
+        # Shop Analysis
+        shop_map, shop_hits = found.shops()
+        priority = sorted(shop_map, key=lambda c: (-shop_hits[c], c))
+        profiles = shops.load(priority) if shops and not refresh else {}
+        now = time.time()
+        reused = {c: p["items"] for c, p in profiles.items() if shops.is_fresh(p, now)}
+        stale = [c for c in priority if c not in reused]
+        if max_shops is not None and len(stale) > max_shops:
+            # 上限を超えた店舗は古いプロフィールがあればそれを使い、なければ省略する
+            for c in stale[max_shops:]:
+                if c in profiles: reused[c] = profiles[c]["items"]
+            stale = stale[:max_shops]
+
+        def fetch_shop(s_code):
+            items = get_shop_top_items(s_code, shop_map.get(s_code, "不明"), limit=30, client=client, refresh=refresh, raise_errors=True)
+            if shops and len(items): shops.save(s_code, shop_map.get(s_code, "不明"), items)
+            return items
+        with METRICS.span("competitor.shop"):
+            fetched = dict(zip(stale, run_phase("shop", stale, fetch_shop)))
+
+        # 指標の計算とDataFrame化は結合後に1回だけ行う
+        sheet1_data = found.to_frame()
+        sheet2_data = ItemColumns.concat(fetched[c] if len(fetched.get(c, ())) else reused.get(c) for c in priority).to_frame()
+        if snapshots:
+            with METRICS.span("snapshots.record"):
+                # キャッシュから返した商品はキャッシュの保存時刻で記録し、同じ観測を新しい取得として数えない
+                snapshots.record(ItemColumns.concat([found, *fetched.values()]).to_frame(with_time=True))
+        if stats is not None:
+            stats.update({"shops": len(priority), "fetched": len(stale), "reused": len(reused),
+                          "skipped": len(priority) - len(stale) - len(reused),
+                          "failed_queries": failed["search"], "failed_shops": failed["shop"],
+                          "rejected_queries": rejected["search"], "rejected_shops": rejected["shop"]})
+
+        # 取得できなかった分があれば未完了のまま残し、再開で取り直せるようにする
+        if store and not (failed["search"] or failed["shop"]): store.finish(job_id)
+        return sheet1_data, sheet2_data
+
+@METRICS.timed("build_dataframe")
+def build_competitor_tables(sheet1_data, sheet2_data):
+    """競合分析の結果を出力用の {シート名: DataFrame} にまとめる"""
+    df1 = pd.DataFrame(sheet1_data)
+    df2 = pd.DataFrame(sheet2_data)
+    
+    if not df1.empty: df1 = df1.sort_values(by='推定累積売上', ascending=False)
+    cols1 = ['検索タイプ', '検索条件', '商品名', '価格', 'レビュー総数', '推定累積販売数', '推定累積売上', 'ポイント倍率', 'クーポン有無', 'ショップ名', '商品URL']
+    df1 = df1.reindex(columns=cols1) if not df1.empty else pd.DataFrame()
+    return {'検索結果': df1, '店舗分析': df2}
+
+def competitor_job(job, queries, fmt="xlsx", resume=False, refresh=False, max_shops=None, limit=10,
+                   client=None, store=None, shops=None, snapshots=None):
+    """競合分析を実行して出力ファイルまで作るジョブ (JobRunner.submitに渡す)"""
+    client = client or get_ichiba_client()
+    store = store or get_checkpoint_store()
+    shops = shops or get_shop_profile_store()
+    snapshots = snapshots or get_snapshot_store()
+    shop_stats = {}
+    # キャッシュの件数はプロセス全体の累計のため、実行前後の差をこの実行の分とする
+    cache_before = client.cache.stats() if client.cache else None
+    job.update(0, f"検索中... (全{len(queries)}件)")
+    def on_progress(phase, done, total):
+        if phase == "search":
+            job.update(done / total * 0.4, f"検索中 ({done}/{total})")
+        else:
+            job.update(0.4 + done / max(1, total) * 0.6, f"店舗詳細分析中... ({done}/{total}店舗)")
+    sheet1_data, sheet2_data = run_competitor_analysis(
+        queries, client=client, store=store, resume=resume, refresh=refresh, on_progress=on_progress,
+        shops=shops, max_shops=max_shops, stats=shop_stats, limit=limit, snapshots=snapshots)
+
+    job.update(message="出力ファイル生成中...")
+    data, ext, mime = export_tables(build_competitor_tables(sheet1_data, sheet2_data), fmt)
+    cache_stats = None
+    if client.cache:
+        cache_stats = client.cache.stats()
+        cache_stats.update(hits=cache_stats["hits"] - cache_before["hits"], misses=cache_stats["misses"] - cache_before["misses"])
+    return {"data": data, "ext": ext, "mime": mime, "shops": shop_stats, "cache": cache_stats}
+
+TREND_LABELS = {
+    "shop_code": "ショップコード", "shop_name": "ショップ名", "item_key": "商品URL", "item_name": "商品名",
+    "items": "比較商品数", "days": "経過日数", "price": "価格", "price_change": "価格変化",
+    "price_change_pct": "価格変化率(%)", "review_delta": "レビュー増加数", "review_velocity": "レビュー増加/日",
+    "est_sales_delta": "推定販売数増加", "est_sales_amt_delta": "推定売上増加",
+}
+
+@METRICS.timed("trends.build")
+def build_trend_tables(snapshots, since=None):
+    """未処理のスナップショットを差分計算に回したうえで、期間内の店舗別・商品別の推移を {シート名: DataFrame} で返す"""
+    snapshots.update_trends()
+    shop = snapshots.load_trends("shop_deltas", since=since)
+    item = snapshots.load_trends("deltas", since=since)
+    if shop.empty or item.empty:
+        return {'店舗別推移': pd.DataFrame(), '商品別推移': pd.DataFrame()}
+
+    item = item.groupby("item_key", observed=True).agg(
+        item_name=("item_name", "last"), shop_name=("shop_name", "last"), days=("days", "sum"),
+        price=("price", "last"), price_change=("price_change", "sum"), review_delta=("review_delta", "sum"),
+        est_sales_delta=("est_sales_delta", "sum"), est_sales_amt_delta=("est_sales_amt_delta", "sum"),
+    ).reset_index()
+    item["review_velocity"] = item["review_delta"] / item["days"].where(item["days"] > 0)
+    shop = shop.groupby("shop_code", observed=True).agg(
+        shop_name=("shop_name", "last"), items=("items", "max"), review_delta=("review_delta", "sum"),
+        review_velocity=("review_velocity", "mean"), est_sales_delta=("est_sales_delta", "sum"),
+        est_sales_amt_delta=("est_sales_amt_delta", "sum"),
+    ).reset_index()
+
+    shop = shop.sort_values("est_sales_amt_delta", ascending=False).rename(columns=TREND_LABELS)
+    item = item.sort_values("est_sales_amt_delta", ascending=False).rename(columns=TREND_LABELS)
+    return {'店舗別推移': shop, '商品別推移': item}
+
+def get_current_price_for_rpp(item_manage_number, shop_code, client=None, raise_errors=False):
+    """raise_errors=Trueではエラー応答・通信エラーをステータス文字列にせず例外として送出する"""
+    client = client or get_ichiba_client()
+    keyword = str(item_manage_number).strip()
+    if ":" in keyword:
+        keyword = keyword.split(":")[-1]
+
+    params = {"shopCode": shop_code, "keyword": keyword, "hits": 1}
+    
+    try:
+        res = client.get(params, timeout=5, endpoint="price")
+        if res.status_code != 200 and raise_errors: raise RakutenApiError(res.status_code, "price")
+        data = res.json()
+        
+        if res.status_code == 200:
+            if 'Items' in data and len(data['Items']) > 0:
+                return data['Items'][0]['Item']['itemPrice'], "成功"
+            else:
+                return None, "該当なし"
+        else:
+            return None, f"APIエラー({res.status_code})"
+    except Exception as e:
+        METRICS.record_error("get_current_price_for_rpp", e)
+        if raise_errors: raise
+        return None, "通信エラー"
+
+@METRICS.timed("rpp.fetch_catalog")
+def fetch_shop_price_index(shop_code, client=None, max_pages=CATALOG_MAX_PAGES):
+    """自店舗の商品一覧をshopCode検索でページ取得し、{商品管理番号: 価格} の索引を作る"""
+    client = client or get_ichiba_client()
+    def fetch_page(page):
+        params = {"shopCode": shop_code, "hits": CATALOG_HITS, "page": page}
+        try:
+            return client.get_json(params, endpoint="catalog", timeout=10)
+        except Exception as e:
+            METRICS.record_error("fetch_shop_price_index", e)
+            raise
+    # 取れなかったページは最後に取り直し、それでも失敗したページの商品は個別検索にまわる
+    fetch_pages = lambda pages: client.map(fetch_page, pages, requeue=True, fallback=lambda page, e: {})
+
+    first = fetch_pages([1])[0]
+    page_count = min(max_pages, int(first.get('pageCount', 1) or 1))
+    pages = [first] + fetch_pages(range(2, page_count + 1))
+
+    index = {}
+    for data in pages:
+        for w in data.get('Items', []):
+            item = w['Item']
+            index[normalize_manage_number(item.get('itemCode', ''))] = item['itemPrice']
+            # itemCodeと管理番号が一致しない商品に備え、URL末尾でも引けるようにする
+            index.setdefault(normalize_manage_number(get_item_key_from_url(item.get('itemUrl', ''))), item['itemPrice'])
+    return index
+
+@METRICS.timed("rpp.resolve_prices")
+def resolve_rpp_prices(item_manage_numbers, shop_code, client=None, on_done=None):
+    """商品管理番号ごとの (価格, ステータス) を返す。
+    店舗カタログの索引で一括解決し、見つからないものだけ個別のキーワード検索で補う。"""
+    client = client or get_ichiba_client()
+    index = fetch_shop_price_index(shop_code, client=client)
+    results = {}
+    misses = []
+    for number in dict.fromkeys(item_manage_numbers):
+        price = index.get(normalize_manage_number(number))
+        if price is not None:
+            results[number] = (price, "成功")
+        else:
+            misses.append(number)
+
+    def give_up(number, e):
+        return None, f"APIエラー({e.status})" if isinstance(e, RakutenApiError) else "通信エラー"
+    fallback = client.map(lambda n: get_current_price_for_rpp(n, shop_code, client=client, raise_errors=True), misses,
+                          on_done=on_done, requeue=True, fallback=give_up)
+    results.update(zip(misses, fallback))
+    return results
+
+def detect_csv_encoding(sample, skip_rows_count=0):
+    """先頭サンプルだけで文字コードを判定する (見出し行が2列以上に分割できたものを採用)"""
+    # 末尾で文字が途切れないよう最後の改行までに切り詰める
+    if b"\n" in sample: sample = sample[:sample.rindex(b"\n") + 1]
+    encodings = ['utf-8-sig', 'utf-8', 'cp932', 'shift_jis']
+    for enc in encodings:
+        try:
+            head = pd.read_csv(io.StringIO(sample.decode(enc)), skiprows=skip_rows_count, nrows=5)
+            if len(head.columns) > 1: return enc
+        except: continue
+    return None
+
+def _reduce_rpp_chunk(df):
+    """RPPレポートの1塊を小さくする。商品管理番号のない行(空行・合計行)を捨て、数値列は「1,234円」「12.5%」などを数値にする。
+    変換できない値は欠損のままにし、既定値はrecommend_bidsで補う。"""
+    if "商品管理番号" in df.columns:
+        numbers = df["商品管理番号"].astype("string").str.strip()
+        valid = numbers.notna() & (numbers != "") & (numbers.str.lower() != "nan")
+        df = df.loc[valid].copy()
+        df["商品管理番号"] = numbers[valid]
+    for col in df.columns:
+        if col in RPP_TEXT_COLUMNS: continue
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col].astype("string").str.replace(r"[,円%]", "", regex=True).str.strip(), errors="coerce")
+    return df
+
+def _concat_rpp_chunks(chunks):
+    """塊ごとに小さくしたRPPレポートを列ごとの型付きバッファ (数値はfloat64の配列、文字列はArrowの配列) に積み、
+    最後に1つのDataFrameにする。塊の一覧とその結合コピーを同時に持たないため、ピークメモリは結果の大きさ程度で済む。"""
+    columns, nums, texts = None, {}, {}
+    for chunk in chunks:
+        chunk = _reduce_rpp_chunk(chunk)
+        if columns is None:
+            columns = list(chunk.columns)
+            nums = {c: array("d") for c in columns if c not in RPP_TEXT_COLUMNS}
+            texts = {c: [] for c in columns if c in RPP_TEXT_COLUMNS}
+        for c, buf in nums.items():
+            buf.frombytes(chunk[c].to_numpy(dtype="float64", na_value=np.nan).tobytes())
+        for c, parts in texts.items():
+            parts.append(pa.array(chunk[c].astype("string[pyarrow]").array))
+    if columns is None: return None
+    # 列は1つずつ追加し、numpyの列をまとめ直すコピー (ブロックの統合) を起こさずにバッファを列ごとに手放す
+    df = pd.DataFrame(index=pd.RangeIndex(len(next(iter(nums.values()), [])) if nums else sum(map(len, next(iter(texts.values()))))))
+    for c in columns:
+        if c in texts:
+            df[c] = pd.arrays.ArrowStringArray(pa.chunked_array(texts.pop(c), type=pa.large_string()))
+            continue
+        values = np.frombuffer(nums.pop(c), dtype=np.float64)
+        mask = np.isnan(values)
+        # 件数・金額などの整数列は整数型に戻す (欠損があれば欠損を許す整数型)
+        if mask.any() or not np.array_equal(values, np.round(values)) or np.abs(values).max(initial=0) >= 2 ** 53:
+            integral = np.all(mask | (values == np.round(values)))
+            df[c] = pd.arrays.IntegerArray(np.where(mask, 0, values).astype("int64"), mask) if integral else values
+        else:
+            df[c] = values.astype("int64")
+    return df
+
+def _xlsx_chunks(file, skip_rows_count, wanted):
+    """xlsxの先頭シートを読み取り専用モードで行単位に読み、必要な列だけの塊にして返す。
+    書式だけ残った空行 (必要な列がすべて空の行) は読み飛ばす。"""
+    wb = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(min_row=skip_rows_count + 1, values_only=True)
+        header = next(rows, None)
+        if not header: return
+        keep = [(i, h) for i, h in enumerate(header) if h in wanted]
+        data = {h: [] for _, h in keep}
+        for row in rows:
+            values = [row[i] if i < len(row) else None for i, _ in keep]
+            if all(v is None for v in values): continue
+            for (_, h), v in zip(keep, values):
+                data[h].append(v)
+            if len(values) and len(data[keep[0][1]]) >= RPP_CSV_CHUNK_ROWS:
+                yield pd.DataFrame(data)
+                data = {h: [] for _, h in keep}
+        yield pd.DataFrame(data)
+    finally:
+        wb.close()
+
+@METRICS.timed("rpp.load_report")
+def load_rpp_report(file, file_name, skip_rows_count=0, columns=RPP_COLUMNS):
+    """RPP実績レポート(CSV/Excel)を必要な列だけ読み込む。読めない場合はNone。
+    CSVは分割読み込み、xlsxはopenpyxlの読み取り専用モードで行単位に読み、塊ごとに不要な行を捨てて数値化しながら積むため、
+    大きな出力でもメモリが増えにくい。商品管理番号のない行は含めない。"""
+    wanted = set(columns)
+    file.seek(0)
+    if file_name.endswith('.xlsx'):
+        try:
+            return _concat_rpp_chunks(_xlsx_chunks(file, skip_rows_count, wanted))
+        except: return None
+    if file_name.endswith('.xls'):
+        try:
+            return _concat_rpp_chunks([pd.read_excel(file, skiprows=skip_rows_count, usecols=lambda c: c in wanted,
+                                                     dtype={c: str for c in RPP_TEXT_COLUMNS})])
+        except: return None
+
+    enc = detect_csv_encoding(file.read(RPP_SNIFF_BYTES), skip_rows_count)
+    if enc is None: return None
+    file.seek(0)
+    try:
+        reader = pd.read_csv(file, encoding=enc, skiprows=skip_rows_count, usecols=lambda c: c in wanted,
+                             dtype={c: str for c in RPP_TEXT_COLUMNS}, chunksize=RPP_CSV_CHUNK_ROWS)
+        return _concat_rpp_chunks(reader)
+    except: return None
+
+def clean_number_column(series, default_val=0):
+    """「1,234円」「12.5%」などの列をまとめて数値化する (変換できない値はdefault_val)"""
+    s_val = series.astype("string").str.replace(r"[,円%]", "", regex=True).str.strip()
+    return pd.to_numeric(s_val, errors="coerce").fillna(default_val)
+
+@METRICS.timed("rpp.recommend_bids")
+def recommend_bids(df_rpp, target_roas, min_cpc, max_cpc, price_map=None):
+    """RPP実績DataFrame全体に入札ルールを列演算で適用し、改善案DataFrameを返す。
+    price_mapは {商品管理番号: (価格, ステータス)} (resolve_rpp_pricesの戻り値)。省略時は価格列なし。"""
+    numbers = df_rpp["商品管理番号"].astype("string").str.strip()
+    valid = numbers.notna() & (numbers != "") & (numbers.str.lower() != "nan")
+    df = df_rpp.loc[valid]
+    numbers = numbers[valid]
+
+    def column(name, default_val):
+        if name not in df.columns: return pd.Series(default_val, index=df.index, dtype="float64")
+        return clean_number_column(df[name], default_val)
+
+    current_bid = column("入札単価", 25)
+    actual_cpc = column("CPC実績(合計)", 25)
+    roas = column("ROAS(合計720時間)(%)", 0)
+    clicks = column("クリック数(合計)", 0).astype("int64")
+    base_cpc = current_bid.where(current_bid > 0, actual_cpc)
+
+    conditions = [
+        (roas == 0) & (clicks > 20),
+        (roas > 0) & (roas < target_roas),
+        roas > (target_roas + 200),
+    ]
+    new_bid = np.select(conditions, [
+        np.maximum(min_cpc, base_cpc - 10),
+        np.maximum(min_cpc, base_cpc - 5),
+        np.minimum(max_cpc, base_cpc + 10),
+    ], default=base_cpc)
+    reason = np.select(conditions, ["クリック過多・売上なし", "ROAS低・抑制", "ROAS好調・強化"], default="維持")
+
+    df_res = pd.DataFrame({"商品管理番号": numbers}, index=df.index)
+    if price_map is not None:
+        # 対応表は重複を除いた商品管理番号ごとに1回だけ引き、行へは位置で展開する
+        codes, uniques = pd.factorize(numbers)
+        lookups = [price_map.get(n, (None, "該当なし")) for n in uniques]
+        prices = np.array([p if p else "取得失敗" for p, _ in lookups], dtype=object)
+        statuses = np.array([msg for _, msg in lookups], dtype=object)
+        df_res["現在価格"] = prices[codes]
+        df_res["APIステータス"] = statuses[codes]
+    df_res["推奨入札単価"] = new_bid.astype("int64")
+    df_res["変更理由"] = reason
+    for col in RPP_COLUMNS:
+        if col != "商品管理番号":
+            df_res[col] = df[col] if col in df.columns else ""
+
+    first_cols = ["商品管理番号", "現在価格", "推奨入札単価", "変更理由", "入札単価", "APIステータス"]
+    other_cols = [c for c in RPP_COLUMNS if c not in ["商品管理番号", "入札単価"]]
+    final_cols = [c for c in first_cols + other_cols if c in df_res.columns]
+    return df_res[final_cols].reset_index(drop=True)
+
+def _export_formats(wb):
+    # セル単位で書式を組み立てず、列ごとの書式を一度だけ作って使い回す
+    base = {"align": "left", "valign": "vcenter"}
+    return {
+        "header": wb.add_format({**base, "bg_color": "#DDDDDD", "pattern": 1}),
+        "text": wb.add_format(base),
+        "number": wb.add_format({**base, "num_format": "#,##0"}),
+        "link": wb.add_format({**base, "font_color": "#0000FF", "underline": 1}),
+    }
+
+def write_sheet(wb, formats, sheet_name, df):
+    """DataFrameを列単位の書式で1シートに書き出す"""
+    ws = wb.add_worksheet(sheet_name)
+    columns = list(df.columns)
+    ws.set_default_row(25)
+    ws.freeze_panes(1, 0)
+    ws.write_row(0, 0, columns, formats["header"])
+
+    values = df.astype(object).where(df.notna(), None)
+    for i, col in enumerate(columns):
+        if col == "商品URL":
+            ws.set_column(i, i, 18, formats["text"])
+            written = 0
+            for r, url in enumerate(values[col], 1):
+                if not url: continue
+                # 上限超過や長すぎるURLはリンクにせず文字列で書く
+                if (written >= XLSX_MAX_URLS or not str(url).startswith(("http://", "https://"))
+                        or ws.write_url(r, i, url, formats["link"]) < 0):
+                    ws.write_string(r, i, str(url), formats["text"])
+                else:
+                    written += 1
+        else:
+            fmt = formats["number"] if col in NUM_COLS else formats["text"]
+            ws.set_column(i, i, 18, fmt)
+            ws.write_column(1, i, values[col].tolist(), fmt)
+
+    if columns:
+        ws.autofilter(0, 0, len(df), len(columns) - 1)
+
+@METRICS.timed("export.xlsx")
+def export_excel(sheets):
+    """{シート名: DataFrame} を書式付きExcelのバイト列にする (空のDataFrameは出力しない)"""
+    output = io.BytesIO()
+    wb = xlsxwriter.Workbook(output, {"in_memory": True, "strings_to_urls": False, "nan_inf_to_errors": True})
+    formats = _export_formats(wb)
+    written = 0
+    for name, df in sheets.items():
+        if df is None or df.empty: continue
+        write_sheet(wb, formats, name, df)
+        written += 1
+    if not written:
+        wb.add_worksheet(next(iter(sheets), "Sheet1"))
+    wb.close()
+    return output.getvalue()
+
+def _to_parquet_bytes(df):
+    # 数値と「取得失敗」などが混在する列は文字列としてParquetに保存する
+    mixed = {c: "string" for c in df.columns if df[c].dtype == object}
+    buf = io.BytesIO()
+    df.astype(mixed).to_parquet(buf, index=False)
+    return buf.getvalue()
+
+def export_tables(sheets, fmt="xlsx"):
+    """{シート名: DataFrame} を指定形式で書き出し、(バイト列, 拡張子, MIME) を返す。
+    CSV/Parquetで複数シートある場合はシートごとのファイルをzipにまとめる。"""
+    if fmt == "xlsx":
+        return export_excel(sheets), "xlsx", EXPORT_MIME["xlsx"]
+    if fmt == "csv":
+        encode = METRICS.timed("export.csv")(lambda df: df.to_csv(index=False).encode("utf-8-sig"))
+    elif fmt == "parquet":
+        encode = METRICS.timed("export.parquet")(_to_parquet_bytes)
+    else:
+        raise ValueError(f"未対応の出力形式です: {fmt}")
+    tables = {name: df for name, df in sheets.items() if df is not None and not df.empty}
+    if len(tables) == 1:
+        return encode(next(iter(tables.values()))), fmt, EXPORT_MIME[fmt]
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, df in tables.items():
+            zf.writestr(f"{name}.{fmt}", encode(df))
+    return buf.getvalue(), "zip", EXPORT_MIME["zip"]
+
+def rpp_job(job, df_rpp, shop_code, target_roas, min_cpc, max_cpc, fmt="xlsx", client=None):
+    """価格取得→入札単価の改善案作成→出力ファイル作成を行うジョブ (JobRunner.submitに渡す)"""
+    client = client or get_ichiba_client()
+    job.update(0, "自店舗の商品価格を一括取得中...")
+    manage_numbers = [str(v).strip() for v in df_rpp["商品管理番号"]]
+    manage_numbers = [n for n in manage_numbers if n and n.lower() != 'nan']
+    def on_price_done(done, total):
+        job.update(done / total, f"個別検索で価格を補完中 ({done}/{total})")
+    price_map = resolve_rpp_prices(manage_numbers, shop_code, client=client, on_done=on_price_done)
+
+    df_res = recommend_bids(df_rpp, target_roas, min_cpc, max_cpc, price_map=price_map)
+    if df_res.empty:
+        return {"table": df_res}
+    job.update(1.0, "出力ファイル生成中...")
+    data, ext, mime = export_tables({'RPP改善案': df_res}, fmt)
+    return {"table": df_res, "data": data, "ext": ext, "mime": mime}
+
+def guess_shop_code(file_name):
+    """RPPレポートのファイル名から店舗IDを推測する (例: lykke-hygge_rpp_202401.csv → lykke-hygge)"""
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    return re.split(r"[_\s]", stem.strip())[0].lower()
+
+def unique_sheet_names(names, reserved=()):
+    """Excelで使えるシート名を重複なく割り当て、{元の名前: シート名} を返す。
+    Excelのシート名は大文字小文字を区別せず31文字まで、[]:*?/\\ は使えないため、置換・切り詰め後に衝突したら連番を付ける。"""
+    used = {r.casefold() for r in reserved}
+    result = {}
+    for name in names:
+        base = re.sub(r"[\[\]:*?/\\]", "_", str(name))[:31] or "_"
+        sheet, n = base, 1
+        while sheet.casefold() in used:
+            n += 1
+            suffix = f"_{n}"
+            sheet = base[:31 - len(suffix)] + suffix
+        used.add(sheet.casefold())
+        result[name] = sheet
+    return result
+
+def summarize_rpp(shop_code, df_res, error=None):
+    """店舗ごとの改善案をサマリーシートの1行にまとめる"""
+    row = {"店舗ID": shop_code, "商品数": len(df_res)}
+    if error is not None:
+        return {**row, "エラー": f"{type(error).__name__}: {error}"}
+    if df_res.empty:
+        return {**row, "エラー": "処理データなし"}
+    reasons = df_res["変更理由"].value_counts()
+    spend = clean_number_column(df_res["実績額(合計)"]).sum() if "実績額(合計)" in df_res.columns else 0
+    sales = clean_number_column(df_res["売上金額(合計720時間)"]).sum() if "売上金額(合計720時間)" in df_res.columns else 0
+    current_bid = clean_number_column(df_res["入札単価"], 25) if "入札単価" in df_res.columns else None
+    return {
+        **row,
+        "価格取得成功": int((df_res["APIステータス"] == "成功").sum()) if "APIステータス" in df_res.columns else 0,
+        "強化": int(reasons.get("ROAS好調・強化", 0)),
+        "抑制": int(reasons.get("ROAS低・抑制", 0) + reasons.get("クリック過多・売上なし", 0)),
+        "維持": int(reasons.get("維持", 0)),
+        "平均入札単価": round(float(current_bid.mean()), 1) if current_bid is not None else None,
+        "平均推奨入札単価": round(float(df_res["推奨入札単価"].mean()), 1),
+        "実績額(合計)": int(spend), "売上金額(合計720時間)": int(sales),
+        "ROAS(%)": round(sales / spend * 100, 1) if spend else None,
+        "エラー": "",
+    }
+
+def optimize_rpp_shops(reports, target_roas, min_cpc, max_cpc, client=None, shop_workers=RPP_SHOP_WORKERS, on_done=None):
+    """複数店舗のRPP改善案をまとめて作り、{シート名: DataFrame} (先頭がサマリー、以降は店舗ごと) を返す。
+    reportsは {店舗ID: RPP実績DataFrame}。店舗は並列に処理し、通信は共通のクライアント (コネクションプール・レート制限) を共有する。
+    1店舗の失敗は他の店舗を止めずサマリーのエラー列に記録する。on_done(完了店舗数, 全店舗数, 店舗ID) は呼び出し元スレッドで呼ばれる。"""
+    client = client or get_ichiba_client()
+    shop_codes = list(reports)
+
+    def process(shop_code):
+        df_rpp = reports[shop_code]
+        numbers = [str(v).strip() for v in df_rpp["商品管理番号"]]
+        numbers = [n for n in numbers if n and n.lower() != 'nan']
+        price_map = resolve_rpp_prices(numbers, shop_code, client=client)
+        return recommend_bids(df_rpp, target_roas, min_cpc, max_cpc, price_map=price_map)
+
+    tables, summary = {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, shop_workers), thread_name_prefix="rpp-shop") as executor:
+        futures = {executor.submit(process, code): code for code in shop_codes}
+        for done, future in enumerate(as_completed(futures), 1):
+            code = futures[future]
+            try:
+                tables[code] = future.result()
+                summary[code] = summarize_rpp(code, tables[code])
+            except Exception as e:
+                METRICS.record_error("optimize_rpp_shops", e)
+                summary[code] = summarize_rpp(code, pd.DataFrame(), error=e)
+            if on_done: on_done(done, len(shop_codes), code)
+
+    names = unique_sheet_names([c for c in shop_codes if c in tables], reserved=[RPP_SUMMARY_SHEET])
+    # 失敗した店舗の行は集計列が欠けるため、列をそろえて件数列は欠損を許す整数型にする
+    summary_df = pd.DataFrame([{**summary[c], "シート名": names.get(c, "")} for c in shop_codes], columns=RPP_SUMMARY_COLUMNS)
+    sheets = {RPP_SUMMARY_SHEET: summary_df.astype({c: "Int64" for c in RPP_SUMMARY_COUNT_COLS})}
+    sheets.update({names[code]: tables[code] for code in shop_codes if code in tables})
+    return sheets
+
+def rpp_multi_job(job, reports, target_roas, min_cpc, max_cpc, fmt="xlsx", client=None, shop_workers=RPP_SHOP_WORKERS):
+    """複数店舗のRPP改善を行い、サマリー+店舗ごとのシートを1つのファイルにするジョブ (JobRunner.submitに渡す)"""
+    job.update(0, f"{len(reports)}店舗の価格を取得中...")
+    def on_done(done, total, shop_code):
+        job.update(done / total, f"{done}/{total}店舗完了 ({shop_code})")
+    sheets = optimize_rpp_shops(reports, target_roas, min_cpc, max_cpc, client=client, shop_workers=shop_workers, on_done=on_done)
+    job.update(1.0, "出力ファイル生成中...")
+    data, ext, mime = export_tables(sheets, fmt)
+    return {"table": sheets[RPP_SUMMARY_SHEET], "data": data, "ext": ext, "mime": mime}
+
+# ==========================================
+# 共通・ロジック関数群 (ブログAI生成: GitHub対応版)
+# ==========================================
+def build_blog_prompt(keywords, tone):
+    return f"""
+    あなたはプロのECサイト運営者兼ブロガーです。
+    アップロードされた商品画像を見て、以下の条件でブログ記事を作成してください。
+
+    【ターゲット・キーワード】
+    {keywords}
+
+    【文体のトーン】
+    {tone}
+
+    【出力要件】
+    1. 記事のタイトルを作成してください。
+    2. 記事の本文は、そのままWordPressやShopifyに貼り付けられる「HTML形式」で出力してください。
+    3. <h2>, <h3>, <p>, <ul>, <li> などのタグを適切に使用し、読みやすくしてください。
+    4. 画像の視覚的特徴（色、素材、雰囲気）を具体的に描写し、読者が商品をイメージできるようにしてください。
+    5. SEOを意識し、キーワードを自然に盛り込んでください。
+    6. 記事の最後には、購買意欲をそそるまとめを書いてください。
+    
+    【画像生成用プロンプト】
+    記事の最後に、別途「この商品を魅力的なシーンで撮影したような画像をAIで作るための英語の指示文（Prompt）」を作成してください。
+    （例: A photorealistic shot of a ceramic vase on a wooden table, sunlight streaming through a window, cozy scandinavian style, 8k resolution...）
+    """
+
+@METRICS.timed("blog.preprocess_image")
+def preprocess_image(data, max_edge=BLOG_IMAGE_MAX_EDGE, fmt=BLOG_IMAGE_FORMAT, quality=BLOG_IMAGE_QUALITY):
+    """画像を長辺max_edgeまで縮小し、EXIFを除いて一度だけ再エンコードする。
+    モデルのフォールバック時も同じバイト列を使い回せるよう {"mime_type", "data"} で返す。"""
+    from PIL import Image, ImageOps
+    fmt = fmt.upper()
+    with Image.open(io.BytesIO(data)) as img:
+        # 向きはEXIFを捨てる前に画素へ反映しておく
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        if fmt == "WEBP" and has_alpha:
+            img = img.convert("RGBA")
+        elif has_alpha:
+            # JPEGは透過を持てないので白背景に合成する
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img.convert("RGBA"), mask=img.convert("RGBA").split()[-1])
+            img = background
+        else:
+            img = img.convert("RGB")
+        buf = io.BytesIO()
+        img.save(buf, format=fmt, quality=quality, optimize=True)
+    return {"mime_type": f"image/{fmt.lower()}", "data": buf.getvalue()}
+
+class GeminiBackend:
+    """Gemini APIで記事を生成する (モデルを順に試し、すべて失敗したら例外)"""
+    name = "gemini"
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def generate(self, prompt, image=None, bucket=None):
+        """bucket(TokenBucket)を渡すと、モデルを試すたびに1トークン取ってから呼び出す"""
+        import google.generativeai as genai
+        genai.configure(api_key=self.api_key)
+
+        # 修正点: 廃止された 'gemini-pro-vision' を削除し、最新の1.5系のみを使用
+        if image:
+            # 画像がある場合: マルチモーダル対応の1.5系のみ
+            models_to_try = ['gemini-1.5-pro', 'gemini-1.5-flash']
+        else:
+            # 画像がない場合: 旧gemini-proも可だが、基本は1.5系推奨
+            models_to_try = ['gemini-1.5-pro', 'gemini-1.5-flash', 'gemini-pro']
+
+        last_error = None
+        
+        for model_name in models_to_try:
+            if bucket: bucket.acquire()
+            start = time.perf_counter()
+            try:
+                model = genai.GenerativeModel(model_name)
+                if image:
+                    response = model.generate_content([prompt, image])
+                else:
+                    response = model.generate_content(prompt)
+                METRICS.observe_call(f"gemini:{model_name}", time.perf_counter() - start, "ok")
+                return response.text 
+                
+            except Exception as e:
+                METRICS.observe_call(f"gemini:{model_name}", time.perf_counter() - start, type(e).__name__)
+                last_error = e
+                # エラー内容をコンソールに出力してデバッグしやすくする
+                print(f"Model {model_name} failed: {e}")
+                continue
+
+        raise RuntimeError(last_error)
+
+class StubBackend:
+    """オフライン検証用のダミーモデル (APIを呼ばず、一定の待ち時間の後に定型の記事を返す)"""
+    name = "stub"
+
+    def __init__(self, delay=BLOG_STUB_DELAY):
+        self.delay = delay
+
+    def generate(self, prompt, image=None, bucket=None):
+        if bucket: bucket.acquire()
+        start = time.perf_counter()
+        time.sleep(self.delay)
+        METRICS.observe_call("stub", time.perf_counter() - start, "ok")
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+        size = f"{len(image['data']):,}バイト ({image['mime_type']})" if image else "なし"
+        return f"<h2>テスト記事 {digest}</h2>\n<p>画像: {size}</p>\n<p>スタブモデルによる出力です。</p>"
+
+def generate_blog_content(api_key, image, keywords, tone, backend=None):
+    """imageはpreprocess_imageの戻り値 (画像なしならNone)"""
+    backend = backend or GeminiBackend(api_key)
+    try:
+        return backend.generate(build_blog_prompt(keywords, tone), image)
+    except Exception as last_error:
+        return f"エラー: AIモデルでの生成に失敗しました。\n詳細: {last_error}\n対策: requirements.txtに 'google-generativeai>=0.8.3' が含まれているか確認してください。"
+
+class BlogCache:
+    """生成済み記事のキャッシュ (画像ハッシュ + キーワード + トーン + モデル種別 をキーにSQLiteへ保存)"""
+    def __init__(self, path=BLOG_DB_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS articles (key TEXT PRIMARY KEY, body TEXT, created_at REAL)")
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(image_bytes, keywords, tone, backend_name):
+        h = hashlib.sha256(image_bytes)
+        h.update(json.dumps([keywords.strip(), tone, backend_name], ensure_ascii=False).encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT body FROM articles WHERE key=?", (key,)).fetchone()
+            if row: self.hits += 1
+            else: self.misses += 1
+            return row[0] if row else None
+
+    def set(self, key, body):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO articles VALUES (?, ?, ?)", (key, body, time.time()))
+            self.conn.commit()
+
+def get_blog_cache():
+    return _get_shared("blog_cache", BlogCache)
+
+def _find_column(df, names):
+    for name in names:
+        if name in df.columns: return name
+    return None
+
+def load_blog_batch(images, keywords_csv=None, default_keywords="", default_tone=None):
+    """バッチ生成の入力を作る。imagesはフォルダのパスかzip(パス/バイト列/ファイル)。
+    keywords_csvは「ファイル名,キーワード[,トーン]」形式(英語列名 file,keywords,tone も可)で、行のない画像は既定値を使う。
+    zipの画像はzip内のパスを名前にし (別フォルダの同名ファイルも区別する)、CSVのファイル名はパス→ファイル名の順に照合する。
+    [{"name", "image_bytes", "keywords", "tone"}] を返す。"""
+    default_tone = default_tone or BLOG_TONES[0]
+    files = {}
+    if isinstance(images, str) and os.path.isdir(images):
+        for name in sorted(os.listdir(images)):
+            if name.lower().endswith(BLOG_IMAGE_EXTS):
+                with open(os.path.join(images, name), "rb") as f:
+                    files[name] = f.read()
+    else:
+        source = io.BytesIO(images) if isinstance(images, bytes) else images
+        with zipfile.ZipFile(source) as zf:
+            for info in sorted(zf.infolist(), key=lambda i: i.filename):
+                name = os.path.basename(info.filename)
+                if info.is_dir() or name.startswith(".") or not name.lower().endswith(BLOG_IMAGE_EXTS): continue
+                files[info.filename] = zf.read(info)
+
+    settings, settings_by_name = {}, {}
+    if keywords_csv is not None:
+        if isinstance(keywords_csv, str):
+            with open(keywords_csv, "rb") as f:
+                raw = f.read()
+        else:
+            raw = keywords_csv if isinstance(keywords_csv, bytes) else keywords_csv.read()
+        enc = detect_csv_encoding(raw[:RPP_SNIFF_BYTES]) or "utf-8"
+        df_kw = pd.read_csv(io.BytesIO(raw), encoding=enc, dtype=str).fillna("")
+        name_col = _find_column(df_kw, ["ファイル名", "file", "filename"])
+        kw_col = _find_column(df_kw, ["キーワード", "keywords", "keyword"])
+        tone_col = _find_column(df_kw, ["トーン", "tone"])
+        if name_col and kw_col:
+            for _, row in df_kw.iterrows():
+                path = row[name_col].strip().replace("\\", "/").removeprefix("./")
+                value = (row[kw_col], row[tone_col] if tone_col and row[tone_col] else None)
+                settings[path] = value
+                settings_by_name[os.path.basename(path)] = value
+
+    entries = []
+    for name, data in files.items():
+        keywords, tone = settings.get(name) or settings_by_name.get(os.path.basename(name), (default_keywords, None))
+        entries.append({"name": name, "image_bytes": data, "keywords": keywords, "tone": tone or default_tone})
+    return entries
+
+def generate_blog_batch(entries, backend, cache=None, max_workers=BLOG_WORKERS, qps=BLOG_QPS, on_done=None,
+                        max_edge=BLOG_IMAGE_MAX_EDGE, image_format=BLOG_IMAGE_FORMAT):
+    """複数画像の記事を同時実行数・秒間リクエスト数を制限して並列生成し、DataFrameで返す。
+    キャッシュにある組み合わせはモデルを呼ばない。on_done(完了数, 全体数) は呼び出し元スレッドで呼ばれる。"""
+    bucket = TokenBucket(qps)
+    def generate(entry):
+        key = BlogCache.make_key(entry["image_bytes"], entry["keywords"], entry["tone"], backend.name)
+        cached = cache.get(key) if cache else None
+        if cached is not None:
+            return cached, "キャッシュ"
+        try:
+            image = preprocess_image(entry["image_bytes"], max_edge=max_edge, fmt=image_format)
+            # モデルの呼び出しごとに (フォールバックで別モデルを試す分も) レート制限をかける
+            text = backend.generate(build_blog_prompt(entry["keywords"], entry["tone"]), image, bucket=bucket)
+        except Exception as e:
+            METRICS.record_error("generate_blog_batch", e)
+            return f"エラー: {e}", "エラー"
+        if cache: cache.set(key, text)
+        return text, "生成"
+
+    entries = list(entries)
+    results = [None] * len(entries)
+    if entries:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(generate, e): i for i, e in enumerate(entries)}
+            for done, future in enumerate(as_completed(futures), 1):
+                results[futures[future]] = future.result()
+                if on_done: on_done(done, len(entries))
+    return pd.DataFrame({
+        "ファイル名": [e["name"] for e in entries],
+        "キーワード": [e["keywords"] for e in entries],
+        "トーン": [e["tone"] for e in entries],
+        "ステータス": [status for _, status in results],
+        "記事": [text for text, _ in results],
+    })
+
+def blog_batch_job(job, entries, backend, fmt="xlsx", max_workers=BLOG_WORKERS, qps=BLOG_QPS, cache=None,
+                   max_edge=BLOG_IMAGE_MAX_EDGE, image_format=BLOG_IMAGE_FORMAT):
+    """ブログ記事のバッチ生成ジョブ (JobRunner.submitに渡す)"""
+    cache = cache or get_blog_cache()
+    job.update(0, f"記事を生成中... (全{len(entries)}件)")
+    def on_done(done, total):
+        job.update(done / total, f"記事を生成中 ({done}/{total})")
+    df = generate_blog_batch(entries, backend, cache=cache, max_workers=max_workers, qps=qps, on_done=on_done,
+                             max_edge=max_edge, image_format=image_format)
+    data, ext, mime = export_tables({'ブログ記事': df}, fmt)
+    return {"table": df, "data": data, "ext": ext, "mime": mime}
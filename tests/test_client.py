@@ -0,0 +1,73 @@
+import time
+
+import pytest
+import requests
+
+import rakuten_core
+from rakuten_core import RATE_DECREASE, IchibaClient, RakutenApiError, TokenBucket, is_transient_error, retry_delay
+
+@pytest.fixture(autouse=True)
+def no_requeue_delay(monkeypatch):
+    monkeypatch.setattr(rakuten_core, "REQUEUE_DELAY", 0.0)
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(20, capacity=1)
+    start = time.monotonic()
+    for _ in range(11):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.45  # 最初の1回以降は1/20秒ずつ
+
+def test_token_bucket_throttle_and_recover():
+    bucket = TokenBucket(4)
+    bucket.on_throttle()
+    bucket.on_throttle()  # 間隔内の2回目は下げない
+    assert bucket.rate == 4 * RATE_DECREASE
+    for _ in range(1000):
+        bucket.on_success()
+    assert bucket.rate == 4
+
+def test_retry_delay_caps_retry_after():
+    assert retry_delay(0, "3600") == rakuten_core.RETRY_MAX_DELAY
+    assert retry_delay(0, "1") >= 1
+
+def test_is_transient_error():
+    assert is_transient_error(RakutenApiError(429))
+    assert is_transient_error(RakutenApiError(503))
+    assert is_transient_error(requests.ConnectionError())
+    assert not is_transient_error(RakutenApiError(404))
+    assert not is_transient_error(ValueError())
+
+def test_map_keeps_input_order():
+    client = IchibaClient(max_workers=4)
+    def slow_first(i):
+        time.sleep(0.05 if i == 0 else 0)
+        return i * 10
+    assert client.map(slow_first, range(5)) == [0, 10, 20, 30, 40]
+
+def test_map_requeues_transient_failures_only():
+    client = IchibaClient(max_workers=4)
+    calls = {}
+    def fetch(key):
+        calls[key] = calls.get(key, 0) + 1
+        if key == "flaky" and calls[key] < 2: raise RakutenApiError(503)
+        if key == "down": raise RakutenApiError(500)
+        if key == "missing": raise RakutenApiError(404)
+        return key.upper()
+    gave_up = []
+    def fallback(key, e):
+        gave_up.append((key, e.status))
+        return None
+    done = []
+    results = client.map(fetch, ["ok", "flaky", "down", "missing"], on_done=lambda n, total: done.append(n),
+                         requeue=True, fallback=fallback)
+    assert results == ["OK", "FLAKY", None, None]
+    assert calls == {"ok": 1, "flaky": 2, "down": rakuten_core.REQUEUE_ROUNDS + 1, "missing": 1}
+    assert sorted(gave_up) == [("down", 500), ("missing", 404)]
+    assert done == [1, 2, 3, 4]
+
+def test_map_without_fallback_raises():
+    client = IchibaClient(max_workers=2)
+    def fetch(key):
+        raise RakutenApiError(404)
+    with pytest.raises(RakutenApiError):
+        client.map(fetch, ["a"], requeue=True)
@@ -0,0 +1,26 @@
+import io
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from rakuten_core import RPP_SUMMARY_SHEET, export_tables, unique_sheet_names
+
+def test_unique_sheet_names_case_insensitive():
+    names = unique_sheet_names(["Shop-A", "shop-a", "SHOP-A"])
+    assert names == {"Shop-A": "Shop-A", "shop-a": "shop-a_2", "SHOP-A": "SHOP-A_3"}
+
+def test_unique_sheet_names_truncation_and_invalid_chars():
+    long = "a" * 40
+    names = unique_sheet_names([long, "a" * 31 + "b", "x/y", "x?y", "[]", RPP_SUMMARY_SHEET], reserved=[RPP_SUMMARY_SHEET])
+    assert all(len(n) <= 31 for n in names.values())
+    assert len({n.casefold() for n in names.values()}) == len(names)
+    assert names[long] == "a" * 31
+    assert names["x/y"] == "x_y" and names["x?y"] == "x_y_2"
+    assert names[RPP_SUMMARY_SHEET] != RPP_SUMMARY_SHEET
+
+def test_unique_sheet_names_export_to_excel():
+    df = pd.DataFrame({"a": [1]})
+    names = unique_sheet_names(["Shop-A", "shop-a"], reserved=[RPP_SUMMARY_SHEET])
+    data, ext, _ = export_tables({RPP_SUMMARY_SHEET: df, **{n: df for n in names.values()}}, "xlsx")
+    assert ext == "xlsx"
+    assert load_workbook(io.BytesIO(data)).sheetnames == [RPP_SUMMARY_SHEET, "Shop-A", "shop-a_2"]
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from rakuten_core import RPP_COLUMNS, clean_number_column, recommend_bids
+
+def clean_number(val, default_val=0):
+    """列演算化する前の1セルずつの数値化 (比較用)"""
+    if pd.isna(val): return default_val
+    s_val = str(val).replace(',', '').replace('円', '').replace('%', '').strip()
+    if s_val == '' or s_val.lower() == 'nan': return default_val
+    try:
+        return float(s_val)
+    except ValueError:
+        return default_val
+
+def recommend_row_by_row(df_rpp, target_roas, min_cpc, max_cpc):
+    """列演算化する前の1行ずつの入札ルール (比較用)"""
+    rows = []
+    for _, row in df_rpp.iterrows():
+        number = str(row.get("商品管理番号", "")).strip()
+        if not number or number.lower() == 'nan': continue
+        current_bid = clean_number(row.get("入札単価"), 25)
+        actual_cpc = clean_number(row.get("CPC実績(合計)"), 25)
+        roas = clean_number(row.get("ROAS(合計720時間)(%)"), 0)
+        clicks = int(clean_number(row.get("クリック数(合計)"), 0))
+        base_cpc = current_bid if current_bid > 0 else actual_cpc
+        new_bid, reason = base_cpc, "維持"
+        if roas == 0 and clicks > 20:
+            new_bid, reason = max(min_cpc, base_cpc - 10), "クリック過多・売上なし"
+        elif 0 < roas < target_roas:
+            new_bid, reason = max(min_cpc, base_cpc - 5), "ROAS低・抑制"
+        elif roas > (target_roas + 200):
+            new_bid, reason = min(max_cpc, base_cpc + 10), "ROAS好調・強化"
+        rows.append({"商品管理番号": number, "推奨入札単価": int(new_bid), "変更理由": reason})
+    return pd.DataFrame(rows, columns=["商品管理番号", "推奨入札単価", "変更理由"])
+
+MESSY = pd.DataFrame({
+    "商品管理番号": ["item-1", " item-2 ", "", None, "nan", "item-6", "item-7", "item-8", "item-9", "item-10"],
+    "入札単価": ["1,000円", "40", "", "50", "50", None, "0", "abc", "60円", "45.5"],
+    "CPC実績(合計)": ["30", "30", "30", "30", "30", "35", "70", "", "40", "40"],
+    "ROAS(合計720時間)(%)": ["0%", "250%", "900", "0", "0", "nan", "", "1,000%", "350.5", "601"],
+    "クリック数(合計)": ["21", "5", "50", "50", "50", "100", "21", "3", "0", "1,200"],
+})
+
+def test_clean_number_column_matches_cellwise():
+    s = pd.Series(["1,000円", "40%", "", None, "nan", " 12.5 ", "abc", 7, 3.5])
+    expected = [clean_number(v, 25) for v in s]
+    assert clean_number_column(s, 25).tolist() == expected
+
+@pytest.mark.parametrize("target_roas", [300, 400])
+def test_recommend_bids_matches_row_by_row(target_roas):
+    result = recommend_bids(MESSY, target_roas, 25, 100)
+    expected = recommend_row_by_row(MESSY, target_roas, 25, 100)
+    pd.testing.assert_frame_equal(result[expected.columns].astype(object), expected.astype(object))
+
+def test_recommend_bids_numeric_item_numbers_and_price_map():
+    df = pd.DataFrame({"商品管理番号": [12345, 67890, 12345], "入札単価": [50, 50, 50],
+                       "ROAS(合計720時間)(%)": [900, 100, 0], "クリック数(合計)": [0, 0, 0]})
+    result = recommend_bids(df, 400, 25, 100, price_map={"12345": (1980, "成功"), "67890": (None, "該当なし")})
+    assert result["商品管理番号"].tolist() == ["12345", "67890", "12345"]
+    assert result["現在価格"].tolist() == [1980, "取得失敗", 1980]
+    assert result["APIステータス"].tolist() == ["成功", "該当なし", "成功"]
+    assert result["推奨入札単価"].tolist() == [60, 45, 50]
+    assert list(result.columns[:6]) == ["商品管理番号", "現在価格", "推奨入札単価", "変更理由", "入札単価", "APIステータス"]
+    assert set(RPP_COLUMNS) <= set(result.columns)
+
+def test_recommend_bids_random_parity():
+    rng = np.random.default_rng(0)
+    n = 500
+    df = pd.DataFrame({
+        "商品管理番号": [f"item-{i}" for i in rng.integers(0, 100, n)],
+        "入札単価": rng.choice(["0", "25", "40", "1,000", "", "80円"], n),
+        "CPC実績(合計)": rng.integers(0, 120, n).astype(str),
+        "ROAS(合計720時間)(%)": rng.choice(["0", "150%", "350", "601", "800%", ""], n),
+        "クリック数(合計)": rng.integers(0, 40, n).astype(str),
+    })
+    result = recommend_bids(df, 400, 25, 100)
+    expected = recommend_row_by_row(df, 400, 25, 100)
+    pd.testing.assert_frame_equal(result[expected.columns].astype(object), expected.astype(object))